@@ -0,0 +1,125 @@
+# backfill_metadata.py
+"""
+Backfill filterable metadata on vectors saved before time-range filters existed.
+
+Older notes only carry `created_at` as an ISO string, which Pinecone cannot
+range-filter. This adds the numeric `created_ts` (epoch seconds) to every
+vector that lacks it, so filtered searches see old notes too.
+
+Notes saved before ids were user-prefixed ('<user_id>-<uuid>') are also
+re-keyed to '<user_id>-<old id>': Pinecone can only list ids by prefix, so
+until then they are missing from exports, the related-notes graph and
+/api/notes/{note_id}/related. Run rebuild_related.py afterwards.
+
+    python backfill_metadata.py            # resumes from its checkpoint
+    python backfill_metadata.py --restart  # start over
+"""
+import os
+import time
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import vector_access
+from export_service import iter_vector_pages
+from langchain_pinecone_service import note_id_prefix
+from reindex import load_checkpoint, save_checkpoint
+
+CHECKPOINT_FILE = os.getenv("BACKFILL_CHECKPOINT_FILE", "backfill_checkpoint.json")
+
+
+def missing_metadata(metadata: dict) -> dict:
+    """The metadata fields this vector still needs (empty dict = nothing to do)."""
+    updates = {}
+    if "created_ts" not in metadata and metadata.get("created_at"):
+        try:
+            updates["created_ts"] = int(datetime.fromisoformat(metadata["created_at"]).timestamp())
+        except ValueError:
+            pass
+    return updates
+
+
+def prefixed_id(record: dict):
+    """
+    The user-prefixed id a legacy (unprefixed) vector should move to, or None.
+    Derived from the old id, so a re-run after a crash writes the same id.
+    """
+    user_id = record["metadata"].get("user_id")
+    if user_id is None:
+        return None
+    prefix = note_id_prefix(int(user_id))
+    if record["id"].startswith(prefix):
+        return None
+    return f"{prefix}{record['id']}"
+
+
+def rekey(records: list, updates: dict) -> int:
+    """
+    Move legacy vectors to their user-prefixed ids (new id written first,
+    then the old one deleted - an interrupted run leaves a copy, never a gap).
+    """
+    moves = [(r, prefixed_id(r)) for r in records]
+    moves = [(r, new_id) for r, new_id in moves if new_id]
+    if not moves:
+        return 0
+
+    vector_access.upsert([
+        {"id": new_id, "values": r["values"], "metadata": {**r["metadata"], **updates.get(r["id"], {})}}
+        for r, new_id in moves
+    ])
+    vector_access.delete([r["id"] for r, _ in moves])
+    return len(moves)
+
+
+def run_backfill(workers: int, checkpoint_path: str, restart: bool = False):
+    """Walk every vector in the index and patch the ones missing filterable fields."""
+    checkpoint = {} if restart else load_checkpoint(checkpoint_path)
+    if "rekeyed" not in checkpoint:
+        # Checkpoint of a version without re-keying - walk the whole index again
+        checkpoint = {}
+    if checkpoint.get("finished"):
+        print(f"✅ Backfill already finished ({checkpoint['updated']} vectors updated)")
+        return
+
+    scanned = checkpoint.get("scanned", 0)
+    updated = checkpoint.get("updated", 0)
+    rekeyed = checkpoint.get("rekeyed", 0)
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for records, next_cursor in iter_vector_pages(cursor=checkpoint.get("cursor")):
+            updates = {r["id"]: missing_metadata(r["metadata"]) for r in records}
+
+            # Legacy ids are rewritten whole (metadata patch included)
+            moved = rekey(records, updates)
+            patches = [
+                (r["id"], updates[r["id"]]) for r in records
+                if updates[r["id"]] and not prefixed_id(r)
+            ]
+
+            # Metadata-only updates - no re-embedding needed
+            list(pool.map(lambda patch: vector_access.update_metadata(*patch), patches))
+
+            scanned += len(records)
+            updated += len(patches)
+            rekeyed += moved
+            save_checkpoint(checkpoint_path, {
+                "cursor": next_cursor,
+                "scanned": scanned,
+                "updated": updated,
+                "rekeyed": rekeyed,
+                "finished": next_cursor is None
+            })
+            rate = scanned / max(time.monotonic() - started, 1e-6)
+            print(f"   {scanned} vectors scanned, {updated} updated, {rekeyed} re-keyed ({rate:.0f}/s)")
+
+    print(f"✅ Backfill finished: {updated} of {scanned} vectors updated, {rekeyed} re-keyed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add filterable metadata (created_ts) to existing vectors and re-key unprefixed ids")
+    parser.add_argument("--workers", type=int, default=8, help="Parallel update calls")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE, help="Checkpoint file path")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start over")
+    args = parser.parse_args()
+
+    run_backfill(args.workers, args.checkpoint, args.restart)
@@ -0,0 +1,72 @@
+# bench_vector_access.py
+"""
+Compare the gRPC and REST data-plane paths against the real index.
+
+    python bench_vector_access.py --queries 200 --vectors 2000
+
+Reports p50/p99 query latency and bulk-upsert throughput per transport.
+Benchmark vectors use ids starting with "bench-" and user_id -1 (never
+matched by a real user's filter); they are deleted when the run ends.
+"""
+import time
+import uuid
+import random
+import argparse
+import vector_access
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def random_vector(dim: int) -> list:
+    return [random.uniform(-1, 1) for _ in range(dim)]
+
+
+def bench_queries(transport: str, dim: int, num_queries: int) -> dict:
+    latencies = []
+    for _ in range(num_queries):
+        vector = random_vector(dim)
+        started = time.perf_counter()
+        vector_access.query(vector, top_k=3, filter={"user_id": {"$eq": -1}}, transport=transport)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return {"p50_ms": percentile(latencies, 0.50), "p99_ms": percentile(latencies, 0.99)}
+
+
+def bench_upserts(transport: str, dim: int, num_vectors: int) -> dict:
+    run_id = uuid.uuid4().hex[:8]
+    vectors = [
+        {
+            "id": f"bench-{run_id}-{i}",
+            "values": random_vector(dim),
+            "metadata": {"user_id": -1, "text": "benchmark vector " * 20}
+        }
+        for i in range(num_vectors)
+    ]
+    started = time.perf_counter()
+    vector_access.upsert(vectors, transport=transport)
+    elapsed = time.perf_counter() - started
+
+    vector_access.delete([v["id"] for v in vectors], transport=transport)
+    return {"vectors_per_s": num_vectors / elapsed, "seconds": elapsed}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark gRPC vs REST Pinecone access")
+    parser.add_argument("--queries", type=int, default=200, help="Queries per transport")
+    parser.add_argument("--vectors", type=int, default=2000, help="Vectors upserted per transport")
+    parser.add_argument("--transports", default="grpc,rest", help="Comma-separated transports to compare")
+    args = parser.parse_args()
+
+    dim = vector_access.describe_index_stats()["dimension"]
+    print(f"📏 Index dimension: {dim}")
+
+    for transport in args.transports.split(","):
+        # Warm up the channel / connection pool first so setup cost isn't measured
+        vector_access.query(random_vector(dim), top_k=1, transport=transport)
+
+        queries = bench_queries(transport, dim, args.queries)
+        upserts = bench_upserts(transport, dim, args.vectors)
+        print(f"{transport:>5}: query p50 {queries['p50_ms']:.1f} ms, p99 {queries['p99_ms']:.1f} ms | "
+              f"upsert {upserts['vectors_per_s']:.0f} vectors/s ({args.vectors} in {upserts['seconds']:.1f}s)")
@@ -0,0 +1,168 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional
+import numpy as np
+import xxhash
+from langchain_pinecone_service import embedding_model, embed_within_deadline
+from deadlines import call_with_deadline
+
+# Token budget for the context handed to the answer model. The default leaves
+# room for the question + special tokens inside one 384-token roberta window.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "320"))
+# Tokenizer of the model that will read the context (Hugging Face repo id)
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "deepset/roberta-base-squad2")
+# Notes whose sentence embeddings are kept in memory
+SENTENCE_CACHE_SIZE = int(os.getenv("SENTENCE_CACHE_SIZE", "2000"))
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+# note hash -> (sentences, normalized embedding matrix, token counts)
+_sentence_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _get_tokenizer():
+    """The answer model's tokenizer, or tiktoken as an approximation if it can't be loaded."""
+    global _tokenizer
+    with _tokenizer_lock:
+        if _tokenizer is None:
+            try:
+                from tokenizers import Tokenizer
+                hf_tokenizer = Tokenizer.from_pretrained(CONTEXT_TOKENIZER)
+                hf_tokenizer.no_truncation()
+                _tokenizer = lambda texts: [len(e.ids) for e in hf_tokenizer.encode_batch(texts, add_special_tokens=False)]
+            except Exception as e:
+                import tiktoken
+                print(f"⚠️ Tokenizer for {CONTEXT_TOKENIZER} unavailable ({e}), counting with tiktoken")
+                encoding = tiktoken.get_encoding("cl100k_base")
+                _tokenizer = lambda texts: [len(ids) for ids in encoding.encode_batch(texts)]
+        return _tokenizer
+
+
+def count_tokens(texts: list) -> list:
+    """Number of tokens of each text, without special tokens."""
+    return _get_tokenizer()(texts)
+
+
+def split_sentences(text: str) -> list:
+    """Split a note into sentences (and lines, for list-style notes)."""
+    return [s.strip() for s in _SENTENCE_SPLIT.split(text) if s and s.strip()]
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def _sentence_embeddings(texts: list) -> list:
+    """
+    (sentences, embeddings, token counts) for every note, embedding only the
+    notes that are not cached yet - all of them in a single embedding call.
+    """
+    keys = [xxhash.xxh64_hexdigest(text) for text in texts]
+
+    with _cache_lock:
+        cached = {key: _sentence_cache[key] for key in keys if key in _sentence_cache}
+        for key in cached:
+            _sentence_cache.move_to_end(key)
+
+    missing = {key: text for key, text in zip(keys, texts) if key not in cached}
+    if missing:
+        split = {key: split_sentences(text) for key, text in missing.items()}
+        all_sentences = [s for sentences in split.values() for s in sentences]
+        vectors = None
+        if all_sentences:
+            embedded = call_with_deadline("embed_sentences", embed_within_deadline, embedding_model, "embed_documents", all_sentences, hedge=True)
+            vectors = _normalize(np.asarray(embedded, dtype=np.float32))
+        token_counts = count_tokens(all_sentences) if all_sentences else []
+
+        offset = 0
+        with _cache_lock:
+            for key, sentences in split.items():
+                n = len(sentences)
+                entry = (sentences, vectors[offset:offset + n] if n else np.zeros((0, 1), dtype=np.float32), token_counts[offset:offset + n])
+                offset += n
+                cached[key] = entry
+                _sentence_cache[key] = entry
+            while len(_sentence_cache) > SENTENCE_CACHE_SIZE:
+                _sentence_cache.popitem(last=False)
+
+    return [cached[key] for key in keys]
+
+
+def truncate_to_budget(text: str, token_budget: int) -> str:
+    """Longest word prefix of `text` that fits in `token_budget` tokens."""
+    words = text.split()
+    low, high = 0, len(words)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens([" ".join(words[:mid])])[0] <= token_budget:
+            low = mid
+        else:
+            high = mid - 1
+    return " ".join(words[:low])
+
+
+def build_context(query: str, texts: list, token_budget: int = CONTEXT_TOKEN_BUDGET, query_vector: Optional[list] = None) -> str:
+    """
+    Build the answer-model context from retrieved notes, keeping only the
+    sentences most similar to the query that fit in `token_budget` tokens.
+
+    Args:
+        query: The user's question
+        texts: Full text of each retrieved note (best match first)
+        token_budget: Max tokens of the returned context (exact, measured
+                      with the answer model's tokenizer)
+        query_vector: The query's embedding from `embedding_model`, if the
+                      search already computed it (saves an embedding call)
+
+    Returns:
+        str: Selected sentences, in their original note order (if not even
+             one sentence fits, the best one cut down to the budget)
+    """
+    texts = [t for t in texts if t and t.strip()]
+    if not texts:
+        return ""
+
+    # Step 1 - Sentences of every note (with cached embeddings + token counts)
+    notes = _sentence_embeddings(texts)
+    sentences, token_counts, positions, matrices = [], [], [], []
+    for note_index, (note_sentences, vectors, counts) in enumerate(notes):
+        for sentence_index, sentence in enumerate(note_sentences):
+            sentences.append(sentence)
+            positions.append((note_index, sentence_index))
+        token_counts.extend(counts)
+        if len(note_sentences):
+            matrices.append(vectors)
+    if not sentences:
+        return ""
+
+    # Step 2 - Score all sentences against the query in one matrix product
+    if query_vector is None:
+        query_vector = call_with_deadline("embed_query", embed_within_deadline, embedding_model, "embed_query", query, hedge=True)
+    scores = np.vstack(matrices) @ _normalize(np.asarray(query_vector, dtype=np.float32))
+
+    # Step 3 - Greedily pack the best sentences into the budget
+    selected = []
+    used = 0
+    for i in np.argsort(-scores):
+        if used + token_counts[i] <= token_budget:
+            selected.append(int(i))
+            used += token_counts[i]
+
+    # Step 4 - Restore reading order, then trim until the joined text fits exactly
+    # (joining can merge/split tokens at sentence boundaries)
+    while selected:
+        context = " ".join(sentences[i] for i in sorted(selected, key=lambda i: positions[i]))
+        if count_tokens([context])[0] <= token_budget:
+            return context
+        selected.remove(min(selected, key=lambda i: scores[i]))
+
+    # Step 5 - Nothing fits (e.g. a note that is one long unpunctuated
+    # paragraph): cut the best sentence down instead of returning nothing
+    return truncate_to_budget(sentences[int(np.argmax(scores))], token_budget)
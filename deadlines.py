@@ -0,0 +1,188 @@
+import os
+import time
+import threading
+import contextvars
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Optional
+import requests
+from sqlalchemy import text
+
+# Clients may shorten (never extend past MAX_DEADLINE_MS) a request's budget with this header
+DEADLINE_HEADER = "X-Request-Timeout-Ms"
+MAX_DEADLINE_MS = int(os.getenv("MAX_DEADLINE_MS", "60000"))
+DEFAULT_DEADLINE_MS = int(os.getenv("DEFAULT_DEADLINE_MS", "10000"))
+
+# Per-endpoint default budgets (milliseconds)
+ENDPOINT_DEADLINES_MS = {
+    "/api/chat": int(os.getenv("CHAT_DEADLINE_MS", "8000")),
+    "/api/chat/batch": int(os.getenv("CHAT_BATCH_DEADLINE_MS", "12000")),
+    "/api/notes": int(os.getenv("SAVE_NOTE_DEADLINE_MS", "10000")),
+}
+
+# Streaming responses get no overall budget: their body is produced page by
+# page long after the handler returned (each upstream call is still bounded
+# by its own timeout)
+UNBOUNDED_PATHS = {"/api/notes/export"}
+
+# Hedging: if an idempotent call is slower than its own recent p95, fire a
+# second identical attempt and take whichever answers first
+HEDGE_REQUESTS = os.getenv("HEDGE_REQUESTS", "true").lower() == "true"
+HEDGE_MIN_SAMPLES = 20       # no hedging until we know the call's latency profile
+HEDGE_MIN_DELAY_MS = 20      # never hedge sooner than this
+
+# Upstream calls run here so they can be abandoned when the budget runs out.
+# Hedges are only fired while at most HEDGE_MAX_IN_FLIGHT calls are running:
+# when the upstream is stuck (e.g. a model cold start), a second attempt would
+# only take a thread from a first attempt that needs one
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "64"))
+HEDGE_MAX_IN_FLIGHT = UPSTREAM_POOL_SIZE // 2
+
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+_upstream_pool = ThreadPoolExecutor(max_workers=UPSTREAM_POOL_SIZE, thread_name_prefix="upstream")
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+_latencies = defaultdict(lambda: deque(maxlen=500))
+_latencies_lock = threading.Lock()
+
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out before an upstream call finished."""
+
+
+def deadline_for(path: str, header_value: Optional[str]) -> Optional[float]:
+    """Budget in seconds: the client's header if valid, else the endpoint's default (None = unbounded)."""
+    if path in UNBOUNDED_PATHS:
+        return None
+    budget_ms = ENDPOINT_DEADLINES_MS.get(path, DEFAULT_DEADLINE_MS)
+    if header_value:
+        try:
+            budget_ms = min(int(header_value), MAX_DEADLINE_MS)
+        except ValueError:
+            pass
+    return max(budget_ms, 0) / 1000
+
+
+def set_deadline(seconds: Optional[float]):
+    """Start the budget for the current request (None = no deadline); returns a token for reset_deadline."""
+    return _deadline.set(time.monotonic() + seconds if seconds is not None else None)
+
+
+def reset_deadline(token):
+    _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current request's budget (None = no deadline set)."""
+    deadline_at = _deadline.get()
+    if deadline_at is None:
+        return None
+    return max(deadline_at - time.monotonic(), 0.0)
+
+
+def apply_statement_timeout(db):
+    """Cap the DB session's statements at the remaining budget (Postgres only)."""
+    budget = remaining()
+    if budget is None or db.bind.dialect.name != "postgresql":
+        return
+    if budget <= 0:
+        raise DeadlineExceeded("No time left for the database lookup")
+    # SET LOCAL lasts until the end of the session's current transaction
+    db.execute(text(f"SET LOCAL statement_timeout = {max(int(budget * 1000), 1)}"))
+
+
+def _record_latency(name: str, seconds: float):
+    with _latencies_lock:
+        _latencies[name].append(seconds)
+
+
+def hedge_delay(name: str) -> Optional[float]:
+    """p95 latency of `name` in seconds, or None while there are too few samples."""
+    with _latencies_lock:
+        samples = sorted(_latencies[name])
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    return max(samples[int(len(samples) * 0.95) - 1], HEDGE_MIN_DELAY_MS / 1000)
+
+
+def _is_timeout(error: BaseException) -> bool:
+    """A call's own timeout (requests / Future.result) - bounded by remaining(), so the deadline."""
+    return isinstance(error, (TimeoutError, requests.exceptions.Timeout))
+
+
+def _call_finished(_future):
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight -= 1
+
+
+def _submit(fn, args, kwargs):
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight += 1
+    # Each attempt runs in its own copy of the caller's context (deadline included)
+    future = _upstream_pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+    future.add_done_callback(_call_finished)
+    return future
+
+
+def _pool_has_room() -> bool:
+    with _in_flight_lock:
+        return _in_flight < HEDGE_MAX_IN_FLIGHT
+
+
+def call_with_deadline(name: str, fn, *args, hedge: bool = False, **kwargs):
+    """
+    Run an upstream call within the remaining request budget.
+
+    Args:
+        name: Call name, used for latency stats and logs (e.g. "embed_query")
+        fn: The blocking call to make
+        hedge: Only for idempotent calls - fire a second attempt once the
+               first is slower than this call's recent p95 (skipped while
+               the upstream pool is busy)
+        *args, **kwargs: Passed to fn
+
+    Returns:
+        Whatever fn returns (from the first attempt to succeed)
+
+    Raises:
+        DeadlineExceeded: If the budget runs out first (the call is abandoned),
+                          or the call hit its own timeout within the budget
+    """
+    budget = remaining()
+    if budget is not None and budget <= 0:
+        raise DeadlineExceeded(f"No time left for {name}")
+
+    started = time.monotonic()
+    deadline_at = started + budget if budget is not None else None
+    delay = hedge_delay(name) if hedge and HEDGE_REQUESTS else None
+    hedge_at = started + delay if delay is not None else None
+
+    pending = {_submit(fn, args, kwargs)}
+    last_error = None
+    while pending:
+        wake_times = [t for t in (deadline_at, hedge_at) if t is not None]
+        timeout = max(min(wake_times) - time.monotonic(), 0) if wake_times else None
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            if future.exception() is None:
+                _record_latency(name, time.monotonic() - started)
+                return future.result()
+            last_error = future.exception()
+
+        now = time.monotonic()
+        if deadline_at is not None and now >= deadline_at:
+            raise DeadlineExceeded(f"{name} did not finish within the request deadline")
+        if hedge_at is not None and now >= hedge_at and pending:
+            hedge_at = None
+            if _pool_has_room():
+                print(f"   ⏱️ Hedging {name} after {(now - started) * 1000:.0f} ms")
+                pending.add(_submit(fn, args, kwargs))
+
+    if deadline_at is not None and _is_timeout(last_error):
+        raise DeadlineExceeded(f"{name} timed out within the request deadline") from last_error
+    raise last_error
@@ -0,0 +1,248 @@
+import os
+import re
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+import numpy as np
+import xxhash
+from sqlalchemy import or_, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from models import NoteFingerprint, IdempotencyKey
+from deadlines import remaining
+
+# What to do when a new note is a near duplicate of an existing one:
+#   "update" - overwrite the existing note in place, but only for autosave-style
+#              edits: same title, existing note saved within NEAR_DUPLICATE_WINDOW_S.
+#              Older similar notes (last week's meeting notes) are never overwritten.
+#   "link"   - don't store anything new, point the client at the existing note
+#   "off"    - only exact duplicates are caught
+NEAR_DUPLICATE_POLICY = os.getenv("NEAR_DUPLICATE_POLICY", "update")
+NEAR_DUPLICATE_WINDOW_S = int(os.getenv("NEAR_DUPLICATE_WINDOW_S", "600"))
+# Max differing SimHash bits for a near duplicate. With 4 bands, any
+# distance <= 3 is guaranteed to share a band (pigeonhole).
+NEAR_DUPLICATE_DISTANCE = int(os.getenv("NEAR_DUPLICATE_DISTANCE", "3"))
+
+# A pending Idempotency-Key reservation older than this was left by a request
+# that died mid-save; a retry may take it over
+IDEMPOTENCY_PENDING_TIMEOUT_S = int(os.getenv("IDEMPOTENCY_PENDING_TIMEOUT_S", "120"))
+IDEMPOTENCY_POLL_S = 0.2
+
+SHINGLE_SIZE = 3
+NUM_BANDS = 4
+BAND_BITS = 64 // NUM_BANDS
+
+
+class IdempotencyConflict(Exception):
+    """Another request with the same Idempotency-Key is still being processed."""
+
+
+@dataclass
+class Reservation:
+    note_id: str
+    completed: bool   # True: note_id is the first request's result, nothing to save
+
+
+@dataclass
+class Fingerprint:
+    content_hash: str
+    simhash: int
+    title_hash: str
+
+    @property
+    def bands(self) -> list:
+        mask = (1 << BAND_BITS) - 1
+        return [(self.simhash >> (BAND_BITS * i)) & mask for i in range(NUM_BANDS)]
+
+
+def _to_signed(value: int) -> int:
+    """PostgreSQL BIGINT is signed; store the unsigned 64-bit hash in it."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+def fingerprint(title: str, content: str) -> Fingerprint:
+    """
+    Fingerprint a note.
+
+    Case, punctuation and whitespace are ignored, so autosaves that only
+    differ there hash identically. The SimHash is built from word 3-shingles:
+    every shingle's 64-bit xxhash votes on every bit.
+    """
+    tokens = re.findall(r"\w+", f"{title} {content}".lower())
+    normalized = " ".join(tokens)
+    content_hash = xxhash.xxh64_hexdigest(normalized)
+    title_hash = xxhash.xxh64_hexdigest(" ".join(re.findall(r"\w+", title.lower())))
+
+    shingles = [" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(max(1, len(tokens) - SHINGLE_SIZE + 1))]
+    hashes = np.array([xxhash.xxh64_intdigest(s) for s in shingles], dtype="<u8")
+
+    # (n_shingles, 64) bit matrix -> majority vote per bit
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    votes = bits.sum(axis=0) * 2 > len(shingles)
+    simhash = int(np.packbits(votes, bitorder="little").view("<u8")[0])
+
+    return Fingerprint(content_hash=content_hash, simhash=simhash, title_hash=title_hash)
+
+
+def find_duplicate(db: Session, user_id: int, fp: Fingerprint) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Look for an existing note of this user with the same or nearly the same content.
+
+    With NEAR_DUPLICATE_POLICY "update", a "near" match is only reported for
+    the same title saved within NEAR_DUPLICATE_WINDOW_S - the note that gets
+    overwritten must be an earlier autosave of this one.
+
+    Returns:
+        tuple: ("exact" | "near", note_id) or (None, None)
+    """
+    exact = db.query(NoteFingerprint).filter(
+        NoteFingerprint.user_id == user_id,
+        NoteFingerprint.content_hash == fp.content_hash
+    ).first()
+    if exact:
+        return "exact", exact.note_id
+
+    if NEAR_DUPLICATE_POLICY == "off":
+        return None, None
+
+    # Candidates share at least one 16-bit band; confirm with the full Hamming distance
+    b0, b1, b2, b3 = fp.bands
+    candidates = db.query(NoteFingerprint).filter(
+        NoteFingerprint.user_id == user_id,
+        or_(
+            NoteFingerprint.band0 == b0,
+            NoteFingerprint.band1 == b1,
+            NoteFingerprint.band2 == b2,
+            NoteFingerprint.band3 == b3
+        )
+    )
+    if NEAR_DUPLICATE_POLICY == "update":
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=NEAR_DUPLICATE_WINDOW_S)
+        candidates = candidates.filter(
+            NoteFingerprint.title_hash == fp.title_hash,
+            NoteFingerprint.updated_at >= cutoff
+        )
+    candidates = candidates.all()
+
+    best_id, best_distance = None, NEAR_DUPLICATE_DISTANCE + 1
+    for candidate in candidates:
+        distance = bin(_to_unsigned(candidate.simhash) ^ fp.simhash).count("1")
+        if distance < best_distance:
+            best_id, best_distance = candidate.note_id, distance
+
+    if best_id is None:
+        return None, None
+    return "near", best_id
+
+
+def record_fingerprint(db: Session, user_id: int, note_id: str, fp: Fingerprint):
+    """Insert or refresh the fingerprint of a stored note."""
+    row = db.query(NoteFingerprint).filter(NoteFingerprint.note_id == note_id).first()
+    if row is None:
+        row = NoteFingerprint(user_id=user_id, note_id=note_id)
+        db.add(row)
+
+    row.content_hash = fp.content_hash
+    row.title_hash = fp.title_hash
+    row.simhash = _to_signed(fp.simhash)
+    row.band0, row.band1, row.band2, row.band3 = fp.bands
+    db.commit()
+
+
+def reserve_idempotency_key(db: Session, user_id: int, key: Optional[str], note_id: str) -> Reservation:
+    """
+    Claim an Idempotency-Key BEFORE the note is embedded and stored, so two
+    concurrent retries with the same key can't both save it. The loser
+    waits for the winner and gets its result.
+
+    The note id is fixed with the first reservation. A retry that takes over
+    a released or abandoned key gets that same id back: the earlier
+    attempt's write may still land, and then the retry overwrites it
+    instead of storing a second copy.
+
+    Args:
+        db: Database session
+        user_id: Owner of the note
+        key: The request's Idempotency-Key header (None = no key)
+        note_id: Id to write the note under if this is the first attempt
+
+    Returns:
+        Reservation: completed=False - this request owns the key and must
+                     save the note under reservation.note_id; completed=True
+                     - note_id is what the first request with this key produced
+
+    Raises:
+        IdempotencyConflict: If the first request is still running when
+                             this one's time budget runs out
+    """
+    if not key:
+        return Reservation(note_id=note_id, completed=False)
+
+    budget = remaining()
+    wait_until = time.monotonic() + (budget if budget is not None else IDEMPOTENCY_PENDING_TIMEOUT_S)
+    while True:
+        db.add(IdempotencyKey(user_id=user_id, key=key, note_id=None, reserved_note_id=note_id))
+        try:
+            db.commit()
+            return Reservation(note_id=note_id, completed=False)
+        except IntegrityError:
+            db.rollback()
+
+        row = db.query(IdempotencyKey.note_id, IdempotencyKey.reserved_note_id).filter(
+            IdempotencyKey.user_id == user_id,
+            IdempotencyKey.key == key
+        ).first()
+        if row is None:
+            continue  # the row was just deleted - claim it
+        if row.note_id is not None:
+            return Reservation(note_id=row.note_id, completed=True)
+
+        # Still pending. Take it over if the earlier attempt failed, or if the
+        # reservation is so old that its request must have died
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=IDEMPOTENCY_PENDING_TIMEOUT_S)
+        taken = db.query(IdempotencyKey).filter(
+            IdempotencyKey.user_id == user_id,
+            IdempotencyKey.key == key,
+            IdempotencyKey.note_id.is_(None),
+            or_(IdempotencyKey.released_at.isnot(None), IdempotencyKey.created_at < cutoff)
+        ).update({"created_at": func.now(), "released_at": None}, synchronize_session=False)
+        db.commit()
+        if taken:
+            return Reservation(note_id=row.reserved_note_id or note_id, completed=False)
+
+        if time.monotonic() >= wait_until:
+            raise IdempotencyConflict("A request with this Idempotency-Key is still being processed")
+        time.sleep(IDEMPOTENCY_POLL_S)
+
+
+def complete_idempotency_key(db: Session, user_id: int, key: Optional[str], note_id: str):
+    """Record the note a reserved Idempotency-Key produced (waiting retries return it)."""
+    if not key:
+        return
+    db.query(IdempotencyKey).filter(
+        IdempotencyKey.user_id == user_id,
+        IdempotencyKey.key == key
+    ).update({"note_id": note_id}, synchronize_session=False)
+    db.commit()
+
+
+def release_idempotency_key(db: Session, user_id: int, key: Optional[str]):
+    """
+    Mark an unfinished reservation as failed, so a retry can take it over
+    right away. The row (and its reserved note id) is kept: the failed
+    attempt's write may still land.
+    """
+    if not key:
+        return
+    db.rollback()
+    db.query(IdempotencyKey).filter(
+        IdempotencyKey.user_id == user_id,
+        IdempotencyKey.key == key,
+        IdempotencyKey.note_id.is_(None)
+    ).update({"released_at": func.now()}, synchronize_session=False)
+    db.commit()
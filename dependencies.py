@@ -5,6 +5,8 @@ from jose import JWTError
 from database import get_db
 from models import User
 from jwt_utils import verify_access_token
+from deadlines import apply_statement_timeout
+from profiling import is_admin
 
 # OAuth2PasswordBearer: Extracts token from Authorization header
 # tokenUrl: Tells FastAPI where to get tokens (used in auto-generated docs)
@@ -57,10 +59,25 @@ def get_current_user(
     except JWTError:
         raise credentials_exception
     
-    # Fetch user from database
+    # Fetch user from database (bounded by the request's remaining time budget)
+    apply_statement_timeout(db)
     user = db.query(User).filter(User.email == email).first()
     
     if user is None:
         raise credentials_exception
     
-    return user
\ No newline at end of file
+    return user
+
+def get_admin_user(current_user: User = Depends(get_current_user)) -> User:
+    """
+    Dependency for admin-only endpoints (users listed in ADMIN_EMAILS).
+
+    Raises:
+        HTTPException 403: If the user is not an admin
+    """
+    if not is_admin(current_user.email):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    return current_user
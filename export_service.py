@@ -0,0 +1,129 @@
+import os
+import json
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+import vector_access
+from langchain_pinecone_service import note_id_prefix
+from note_store import hydrate
+
+# Pinecone's list endpoint returns at most 100 ids per page
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "100"))
+
+# Binary export layout (all integers little-endian uint32):
+#   header: b"BVX1"
+#   note:   b"N" | id_len | id | meta_len | meta_json | dim | dim * float32
+#   cursor: b"C" | cursor_len | cursor
+#   end:    b"E"
+BINARY_MAGIC = b"BVX1"
+
+
+def fetch_page(prefix: Optional[str], cursor: Optional[str], page_size: int = EXPORT_PAGE_SIZE) -> Tuple[List[dict], Optional[str]]:
+    """
+    Fetch one page of vectors (ids + values + metadata) from Pinecone.
+
+    Args:
+        prefix: Only list ids starting with this prefix (None = whole index)
+        cursor: Pagination token returned by the previous page
+        page_size: Max number of ids per page
+
+    Returns:
+        tuple: (records, next_cursor) - next_cursor is None on the last page
+    """
+
+    # Step 1 - List the next page of ids
+    ids, next_cursor = vector_access.list_ids(prefix, cursor, page_size)
+
+    if not ids:
+        return [], next_cursor
+
+    # Step 2 - Fetch values + metadata for exactly those ids
+    fetched = vector_access.fetch(ids)
+
+    # Keep list order so cursors stay meaningful (ids deleted in between are skipped)
+    records = [fetched[vector_id] for vector_id in ids if vector_id in fetched]
+    return records, next_cursor
+
+
+def iter_vector_pages(prefix: Optional[str] = None, cursor: Optional[str] = None, page_size: int = EXPORT_PAGE_SIZE) -> Iterator[Tuple[List[dict], Optional[str]]]:
+    """
+    Page through vectors in bounded batches, prefetching the next page
+    while the caller is still consuming the current one.
+
+    At most two pages are held in memory at any time, so memory stays
+    constant regardless of how many vectors match the prefix.
+
+    Yields:
+        tuple: (records, next_cursor) - pass next_cursor back in to resume
+    """
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pending = pool.submit(fetch_page, prefix, cursor, page_size)
+        while pending is not None:
+            records, next_cursor = pending.result()
+            # Kick off the next page before handing this one to the caller
+            pending = pool.submit(fetch_page, prefix, next_cursor, page_size) if next_cursor else None
+            yield records, next_cursor
+
+
+def _export_record(record: dict, include_vectors: bool) -> dict:
+    """Shape a raw Pinecone record into an export row."""
+    metadata = record["metadata"]
+    row = {
+        "id": record["id"],
+        "title": metadata.get("title", ""),
+        "content": metadata.get("content", ""),
+        "metadata": {k: v for k, v in metadata.items() if k not in ("title", "content", "text")}
+    }
+    if include_vectors:
+        row["values"] = record["values"]
+    return row
+
+
+def export_notes_ndjson(user_id: int, cursor: Optional[str] = None, include_vectors: bool = True) -> Iterator[bytes]:
+    """
+    Stream a user's notes as NDJSON.
+
+    Every page of notes is followed by a {"type": "cursor"} line; a client
+    that gets cut off can resume by passing the last cursor it saw.
+    The stream ends with a {"type": "end"} line.
+    """
+    for records, next_cursor in iter_vector_pages(note_id_prefix(user_id), cursor):
+        hydrate(records)  # one bodies lookup per page for slim vectors
+        for record in records:
+            if record["metadata"].get("user_id") != user_id:
+                continue  # never leak another user's vector
+            row = {"type": "note", **_export_record(record, include_vectors)}
+            yield (json.dumps(row) + "\n").encode("utf-8")
+        if next_cursor:
+            yield (json.dumps({"type": "cursor", "cursor": next_cursor}) + "\n").encode("utf-8")
+
+    yield (json.dumps({"type": "end"}) + "\n").encode("utf-8")
+
+
+def export_notes_binary(user_id: int, cursor: Optional[str] = None, include_vectors: bool = True) -> Iterator[bytes]:
+    """
+    Stream a user's notes in the compact binary format (see BINARY_MAGIC).
+    Vectors are packed as little-endian float32 instead of JSON floats.
+    """
+    yield BINARY_MAGIC
+
+    for records, next_cursor in iter_vector_pages(note_id_prefix(user_id), cursor):
+        hydrate(records)
+        chunks = []
+        for record in records:
+            if record["metadata"].get("user_id") != user_id:
+                continue
+            row = _export_record(record, include_vectors=False)
+            vector_id = row.pop("id").encode("utf-8")
+            meta = json.dumps(row).encode("utf-8")
+            values = record["values"] if include_vectors else []
+            chunks.append(b"N")
+            chunks.append(struct.pack("<I", len(vector_id)) + vector_id)
+            chunks.append(struct.pack("<I", len(meta)) + meta)
+            chunks.append(struct.pack(f"<I{len(values)}f", len(values), *values))
+        if next_cursor:
+            token = next_cursor.encode("utf-8")
+            chunks.append(b"C" + struct.pack("<I", len(token)) + token)
+        yield b"".join(chunks)
+
+    yield b"E"
@@ -0,0 +1,488 @@
+import os
+import json
+import time
+import uuid
+import queue
+import zipfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, Optional
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+import vector_access
+from database import SessionLocal
+from models import ImportJob
+from dedupe_service import NEAR_DUPLICATE_POLICY, fingerprint, find_duplicate, record_fingerprint
+from langchain_pinecone_service import (
+    embedding_model,
+    target_embedding_model,
+    note_id_prefix,
+    normalize_tags,
+    REINDEX_DUAL_WRITE,
+    REINDEX_TARGET_INDEX,
+)
+from note_store import SLIM_VECTOR_METADATA, slim_metadata, save_note_bodies
+from rebuild_related import rebuild_user
+
+# Uploaded archives are kept here until their import finishes (resume reads them again)
+IMPORT_DIR = os.getenv("IMPORT_DIR", "imports")
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(500 * 1024 * 1024)))
+# A zip member is decompressed into memory - bigger ones (zip bombs) count as failed
+IMPORT_MAX_MEMBER_BYTES = int(os.getenv("IMPORT_MAX_MEMBER_BYTES", str(10 * 1024 * 1024)))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "32"))    # notes per embedding call
+IMPORT_QUEUE_DEPTH = int(os.getenv("IMPORT_QUEUE_DEPTH", "4"))   # batches buffered between stages
+IMPORT_STALE_S = int(os.getenv("IMPORT_STALE_S", "300"))         # "running" without a checkpoint this long = dead
+# The related-notes graph is rebuilt once an import finishes - after this
+# delay, so the index lists the vectors just written
+IMPORT_RELATED_DELAY_S = float(os.getenv("IMPORT_RELATED_DELAY_S", "10"))
+
+MARKDOWN_SUFFIXES = (".md", ".markdown", ".txt")
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+# Note ids are derived from (job, record number), so a resumed import
+# overwrites what the interrupted run already wrote instead of duplicating it
+IMPORT_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "brainvault/import")
+
+_import_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="import")
+_DONE = object()
+
+
+class ImportTooLarge(Exception):
+    """The uploaded archive is bigger than IMPORT_MAX_BYTES."""
+
+
+def import_format(filename: str) -> Optional[str]:
+    """Archive format from the file name: "ndjson", "zip" or None (unsupported)."""
+    name = (filename or "").lower()
+    if name.endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    if name.endswith(".zip"):
+        return "zip"
+    return None
+
+
+def import_note_id(user_id: int, job_id: str, index: int) -> str:
+    return f"{note_id_prefix(user_id)}{uuid.uuid5(IMPORT_NAMESPACE, f'{job_id}:{index}')}"
+
+
+# ============ PARSING ============
+
+def _markdown_members(archive: zipfile.ZipFile) -> list:
+    """Note files of a zip archive, in archive order."""
+    return [
+        member for member in archive.infolist()
+        if not member.is_dir() and member.filename.lower().endswith(MARKDOWN_SUFFIXES)
+    ]
+
+
+def _markdown_note(filename: str, text: str) -> Optional[dict]:
+    """A Markdown/text file as a note: a leading "# Heading" is the title, else the file name."""
+    lines = text.strip().splitlines()
+    if lines and lines[0].startswith("# "):
+        title, content = lines[0][2:].strip(), "\n".join(lines[1:]).strip()
+    else:
+        title, content = os.path.splitext(os.path.basename(filename))[0], text.strip()
+    if not content:
+        return None
+    return {"title": title or "Untitled", "content": content, "tags": [], "created_ts": None}
+
+
+def _ndjson_note(row) -> Optional[dict]:
+    """One NDJSON row as a note - {"title", "content", "tags"} or a line of our own export."""
+    if not isinstance(row, dict) or not isinstance(row.get("content"), str) or not row["content"].strip():
+        return None
+    metadata = row.get("metadata") if isinstance(row.get("metadata"), dict) else {}
+    tags = row.get("tags") or metadata.get("tags") or []
+    return {
+        "title": str(row.get("title") or row["content"].strip()[:60]),
+        "content": row["content"],
+        "tags": tags if isinstance(tags, list) else [],
+        "created_ts": metadata.get("created_ts")
+    }
+
+
+def _ndjson_rows(path: str) -> Iterator:
+    """Parsed NDJSON rows, skipping blank lines and export cursor/end lines (None = invalid JSON)."""
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            if isinstance(row, dict) and row.get("type") in ("cursor", "end"):
+                continue
+            yield row
+
+
+def iter_records(path: str, fmt: str, start: int = 0) -> Iterator[Optional[dict]]:
+    """
+    Lazily read an archive's notes, one at a time, from record number `start`.
+
+    Yields:
+        dict: {"title", "content", "tags", "created_ts"}, or None for a
+              record that can't be read (counted as failed)
+    """
+    if fmt == "zip":
+        with zipfile.ZipFile(path) as archive:
+            for member in _markdown_members(archive)[start:]:
+                if member.file_size > IMPORT_MAX_MEMBER_BYTES:
+                    yield None
+                    continue
+                try:
+                    # The header's size can lie - never read past the cap
+                    with archive.open(member) as f:
+                        data = f.read(IMPORT_MAX_MEMBER_BYTES + 1)
+                except (zipfile.BadZipFile, OSError, RuntimeError):
+                    yield None
+                    continue
+                if len(data) > IMPORT_MAX_MEMBER_BYTES:
+                    yield None
+                    continue
+                yield _markdown_note(member.filename, data.decode("utf-8", errors="replace"))
+    else:
+        for index, row in enumerate(_ndjson_rows(path)):
+            if index >= start:
+                yield _ndjson_note(row)
+
+
+def count_records(path: str, fmt: str) -> int:
+    """Number of records in an archive (for progress reporting)."""
+    if fmt == "zip":
+        with zipfile.ZipFile(path) as archive:
+            return len(_markdown_members(archive))
+    return sum(1 for _ in _ndjson_rows(path))
+
+
+# ============ JOBS ============
+
+def create_import_job(db: Session, user_id: int, filename: str, fmt: str, upload) -> ImportJob:
+    """
+    Save an uploaded archive to IMPORT_DIR (streamed in chunks) and record the job.
+
+    Raises:
+        ImportTooLarge: If the upload exceeds IMPORT_MAX_BYTES
+        zipfile.BadZipFile: If a .zip upload is not a valid zip archive
+    """
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    job_id = str(uuid.uuid4())
+    path = os.path.join(IMPORT_DIR, f"{job_id}.{fmt}")
+
+    size = 0
+    try:
+        with open(path, "wb") as f:
+            while chunk := upload.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if size > IMPORT_MAX_BYTES:
+                    raise ImportTooLarge(f"Archive is larger than {IMPORT_MAX_BYTES // (1024 * 1024)} MB")
+                f.write(chunk)
+        total = count_records(path, fmt)
+    except Exception:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+    job = ImportJob(id=job_id, user_id=user_id, filename=filename, format=fmt, path=path, status="queued", total=total)
+    db.add(job)
+    db.commit()
+    return job
+
+
+def start_import(job_id: str):
+    """Run the import in the background (this worker's import pool)."""
+    def log_failure(future):
+        if future.exception() is not None:
+            print(f"❌ Import {job_id} crashed: {future.exception()}")
+
+    _import_pool.submit(run_import, job_id).add_done_callback(log_failure)
+
+
+def resume_import(db: Session, job: ImportJob) -> bool:
+    """
+    Restart a failed import, or one whose worker died mid-run (no checkpoint
+    for IMPORT_STALE_S), from its last checkpoint.
+
+    Returns:
+        bool: False if the job is finished or still running
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=IMPORT_STALE_S)
+    claimed = db.query(ImportJob).filter(
+        ImportJob.id == job.id,
+        or_(
+            ImportJob.status == "failed",
+            and_(ImportJob.status.in_(["queued", "running"]), ImportJob.updated_at < cutoff)
+        )
+    ).update({"status": "queued", "error": None}, synchronize_session=False)
+    db.commit()
+
+    if not claimed:
+        return False
+    start_import(job.id)
+    return True
+
+
+def import_status(job: ImportJob) -> dict:
+    """Progress and throughput of an import job."""
+    status = {
+        "job_id": job.id,
+        "filename": job.filename,
+        "status": job.status,
+        "total": job.total,
+        "processed": job.processed,
+        "imported": job.imported,
+        "duplicates": job.duplicates,
+        "failed": job.failed,
+        "records_per_s": round(job.rate, 1) if job.rate else None,
+        "error": job.error
+    }
+    if job.total:
+        status["percent"] = round(100 * job.processed / job.total, 1)
+        if job.rate and job.status == "running":
+            status["eta_s"] = round((job.total - job.processed) / job.rate)
+    return status
+
+
+# ============ PIPELINE ============
+# parse -> dedupe -> batch (thread 1) -> embed (thread 2) -> upsert + checkpoint (job thread)
+# Stages are connected by queues of IMPORT_QUEUE_DEPTH batches: a slow stage
+# blocks the ones before it, so at most a few batches are ever in memory.
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """Blocking put that gives up once the pipeline is stopped."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _drain(q: queue.Queue) -> Iterator:
+    """Items from an upstream stage until it is done (re-raises its error)."""
+    while True:
+        item = q.get()
+        if item is _DONE:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+def _run_stage(items, stop: threading.Event) -> queue.Queue:
+    """Consume the `items` generator in its own thread, feeding a bounded queue."""
+    out = queue.Queue(maxsize=IMPORT_QUEUE_DEPTH)
+
+    def run():
+        try:
+            for item in items:
+                if not _put(out, item, stop):
+                    return
+            _put(out, _DONE, stop)
+        except Exception as e:
+            _put(out, e, stop)
+
+    threading.Thread(target=run, daemon=True).start()
+    return out
+
+
+def _dedupe(db: Session, job: dict, index: int, record: dict, seen: set) -> Optional[dict]:
+    """
+    Turn a record into a note to store, or None if the user already has it.
+
+    Fingerprints are only recorded once the note is written (_write_batch);
+    until then, copies within the archive are caught by `seen`, the content
+    hashes of the notes queued but not yet written (so it stays a few
+    batches small, whatever the archive size).
+    """
+    note_id = import_note_id(job["user_id"], job["id"], index)
+    fp = fingerprint(record["title"], record["content"])
+    if fp.content_hash in seen:
+        return None
+
+    duplicate, existing_note_id = find_duplicate(db, job["user_id"], fp)
+    # existing_note_id == note_id: this record was stored by an interrupted run - redo it
+    if duplicate and existing_note_id != note_id:
+        if duplicate == "exact" or NEAR_DUPLICATE_POLICY == "link":
+            return None
+        note_id = existing_note_id  # "update": overwrite the near duplicate in place
+    seen.add(fp.content_hash)
+
+    # Our own exports carry created_ts as a float (Pinecone returns numbers that way)
+    created_ts = record["created_ts"]
+    created_ts = int(created_ts) if isinstance(created_ts, (int, float)) and not isinstance(created_ts, bool) else int(time.time())
+    metadata = {
+        "title": record["title"],
+        "content": record["content"],
+        "text": f"{record['title']}. {record['content']}",
+        "user_id": job["user_id"],
+        "created_at": datetime.fromtimestamp(created_ts).isoformat(),
+        "created_ts": created_ts
+    }
+    tags = normalize_tags(record["tags"])
+    if tags:
+        metadata["tags"] = tags
+    return {"id": note_id, "metadata": metadata, "fingerprint": fp}
+
+
+def _prepared_batches(job: dict, start: int, stop: threading.Event, seen: set) -> Iterator[dict]:
+    """
+    Stage 1: parse -> dedupe -> batch.
+
+    Yields:
+        dict: {"end": records handled up to here, "notes": [...],
+               "duplicates": n, "failed": n}
+    """
+    db = SessionLocal()
+    try:
+        batch_start = start
+        batch = {"end": start, "notes": [], "duplicates": 0, "failed": 0}
+        for index, record in enumerate(iter_records(job["path"], job["format"], start), start):
+            if stop.is_set():
+                return
+            if record is None:
+                batch["failed"] += 1
+            else:
+                note = _dedupe(db, job, index, record, seen)
+                if note is None:
+                    batch["duplicates"] += 1
+                else:
+                    batch["notes"].append(note)
+            batch["end"] = index + 1
+
+            # Cut a batch when it is full - or after a long run of skipped records,
+            # so the checkpoint still advances
+            if len(batch["notes"]) >= IMPORT_BATCH_SIZE or batch["end"] - batch_start >= IMPORT_BATCH_SIZE * 4:
+                yield batch
+                batch_start = batch["end"]
+                batch = {"end": batch_start, "notes": [], "duplicates": 0, "failed": 0}
+
+        if batch["end"] > batch_start:
+            yield batch
+    finally:
+        db.close()
+
+
+def _embedded_batches(batches: Iterator[dict]) -> Iterator[dict]:
+    """Stage 2: one embed_documents call per batch."""
+    for batch in batches:
+        texts = [note["metadata"]["text"] for note in batch["notes"]]
+        batch["vectors"] = embedding_model.embed_documents(texts) if texts else []
+        yield batch
+
+
+def _write_batch(db: Session, batch: dict, seen: set):
+    """
+    Stage 3: bulk upsert (and note bodies in slim mode), then the notes'
+    fingerprints - a failed upsert must not leave fingerprints behind that
+    would make the retry skip the notes as duplicates.
+    """
+    notes = batch["notes"]
+    if not notes:
+        return
+
+    if SLIM_VECTOR_METADATA:
+        save_note_bodies([
+            {"id": n["id"], "user_id": n["metadata"]["user_id"], "title": n["metadata"]["title"], "content": n["metadata"]["content"]}
+            for n in notes
+        ])
+    vector_metadata = [slim_metadata(n["metadata"]) if SLIM_VECTOR_METADATA else n["metadata"] for n in notes]
+
+    vector_access.upsert([
+        {"id": n["id"], "values": values, "metadata": metadata}
+        for n, values, metadata in zip(notes, batch["vectors"], vector_metadata)
+    ])
+
+    # Keep a running re-index migration complete (see reindex.py)
+    if REINDEX_DUAL_WRITE and target_embedding_model is not None:
+        target_vectors = target_embedding_model.embed_documents([n["metadata"]["text"] for n in notes])
+        vector_access.upsert(
+            [
+                {"id": n["id"], "values": values, "metadata": metadata}
+                for n, values, metadata in zip(notes, target_vectors, vector_metadata)
+            ],
+            index_name=REINDEX_TARGET_INDEX
+        )
+
+    for n in notes:
+        record_fingerprint(db, n["metadata"]["user_id"], n["id"], n["fingerprint"])
+        # find_duplicate catches later copies of written notes from here on
+        seen.discard(n["fingerprint"].content_hash)
+
+
+def _rebuild_related(user_id: int):
+    """Rebuild a user's related-notes graph after an import (imports skip the per-note updates)."""
+    try:
+        count = rebuild_user(user_id)
+        print(f"🔗 Related notes rebuilt for user {user_id} ({count} notes)")
+    except Exception as e:
+        print(f"⚠️ Related-notes rebuild for user {user_id} failed: {e} - run rebuild_related.py --user-id {user_id}")
+
+
+def _schedule_related_rebuild(user_id: int):
+    """Run _rebuild_related in the background once IMPORT_RELATED_DELAY_S has passed."""
+    timer = threading.Timer(IMPORT_RELATED_DELAY_S, _rebuild_related, args=(user_id,))
+    timer.daemon = True
+    timer.start()
+
+
+def run_import(job_id: str):
+    """
+    Run (or resume) one import job to completion. The job row is the
+    checkpoint: after every written batch it records how many archive
+    records are done, so a resumed run skips straight past them.
+    """
+    db = SessionLocal()
+    try:
+        # Claim the job - if another worker already did, leave it alone
+        claimed = db.query(ImportJob).filter(
+            ImportJob.id == job_id, ImportJob.status == "queued"
+        ).update({"status": "running"}, synchronize_session=False)
+        db.commit()
+        if not claimed:
+            return
+
+        job = db.get(ImportJob, job_id)
+        start = job.processed
+        started = time.monotonic()
+        print(f"📥 Import {job_id} for user {job.user_id}: starting at record {start} of {job.total}")
+
+        stop = threading.Event()
+        snapshot = {"id": job.id, "user_id": job.user_id, "path": job.path, "format": job.format}
+        try:
+            pending_hashes = set()  # shared by stage 1 (adds) and stage 3 (discards once fingerprinted)
+            prepared = _run_stage(_prepared_batches(snapshot, start, stop, pending_hashes), stop)
+            embedded = _run_stage(_embedded_batches(_drain(prepared)), stop)
+
+            for batch in _drain(embedded):
+                _write_batch(db, batch, pending_hashes)
+
+                job.processed = batch["end"]
+                job.imported += len(batch["notes"])
+                job.duplicates += batch["duplicates"]
+                job.failed += batch["failed"]
+                job.rate = (job.processed - start) / max(time.monotonic() - started, 1e-6)
+                db.commit()
+                print(f"   {job.processed}/{job.total} records ({job.rate:.1f}/s)")
+
+            job.status = "finished"
+            job.finished_at = datetime.now(timezone.utc)
+            db.commit()
+            os.remove(job.path)
+            print(f"✅ Import {job_id} finished: {job.imported} imported, "
+                  f"{job.duplicates} duplicates, {job.failed} failed")
+            # Bulk writes bypass related_notes.schedule_update - rebuild the user's graph in one pass
+            if job.imported:
+                _schedule_related_rebuild(job.user_id)
+        except Exception as e:
+            db.rollback()
+            job.status = "failed"
+            job.error = str(e)[:1000]
+            db.commit()
+            print(f"❌ Import {job_id} failed at record {job.processed}: {e}")
+        finally:
+            stop.set()
+    finally:
+        db.close()
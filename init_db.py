@@ -1,6 +1,6 @@
 # init_db.py
 from database import engine, Base
-from models import User  # Import all models here
+from models import User, NoteFingerprint, IdempotencyKey, Note, RecentWrite, NoteNeighbors, ImportJob  # Import all models here
 
 def init_db():
     """
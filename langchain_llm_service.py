@@ -1,14 +1,24 @@
 import os
+from typing import Optional
 from dotenv import load_dotenv
 from langchain_huggingface import HuggingFaceEndpoint
 from langchain_core.runnables import RunnablePassthrough, RunnableLambda
 from langchain_core.prompts import PromptTemplate
-from langchain_pinecone_service import vectorstore
+from langchain_core.documents import Document
+from langchain_pinecone_service import vectorstore, embedding_model
+from note_store import SLIM_VECTOR_METADATA, hydrate
+import vector_access
+from context_builder import build_context
+from deadlines import call_with_deadline, remaining
+from profiling import profile_block, should_sample
 import requests
 load_dotenv()
 
 HF_TOKEN = os.getenv("HF_TOKEN")
 
+# "remote" = hosted HF inference endpoint, "local" = roberta on this machine's CPU
+QA_BACKEND = os.getenv("QA_BACKEND", "remote")
+
 # Setup the LLM model
 # llm = HuggingFaceEndpoint(
 #     repo_id="deepset/roberta-base-squad2",
@@ -30,7 +40,8 @@ def call_roberta(input: dict) -> str:
                 "context": context
             },
             "options": {"wait_for_model": True}
-        }
+        },
+        timeout=remaining()  # None outside a request = wait as long as it takes
     )
     result = response.json()
     return result.get("answer", "I couldn't find an answer!")
@@ -42,7 +53,18 @@ llm = HuggingFaceEndpoint(
     max_new_tokens=256
 )
 # Step 1 - Setup retriever from vectorstore
-retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
+def retrieve_documents(question: str) -> list:
+    """Retriever for slim vectors: search by id, then load the note bodies from Postgres."""
+    results = hydrate(vector_access.query(embedding_model.embed_query(question), 3))
+    return [
+        Document(page_content=r["metadata"].get("text", ""), metadata={"id": r["id"], "score": r["score"]})
+        for r in results
+    ]
+
+if SLIM_VECTOR_METADATA:
+    retriever = RunnableLambda(retrieve_documents)  # vectors carry no "text" for the vectorstore to read
+else:
+    retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
 
 # Step 2 - Setup prompt template
 prompt = PromptTemplate.from_template("""
@@ -57,6 +79,14 @@ Answer:
 def format_docs(docs):
     return " ".join([doc.page_content for doc in docs])
 
+# Step 3b - Keep only the sentences that matter, within the model's token budget
+def select_context(inputs: dict) -> dict:
+    question = inputs["question"]
+    return {
+        "question": question,
+        "context": build_context(question, [doc.page_content for doc in inputs["docs"]])
+    }
+
 # Step 4 - Build the LCEL chain using | pipe!
 # chain = (
 #     {
@@ -67,20 +97,48 @@ def format_docs(docs):
 #     | llm                                    # send to HuggingFace model
 # )
 
-# Step 4 - LCEL chain with RunnableLambda wrapping roberta!
+# Step 4 - Pick the answer step: hosted roberta, or the same model run locally
+if QA_BACKEND == "local":
+    from local_qa_service import call_local_qa
+    answer_step = RunnableLambda(call_local_qa)
+else:
+    answer_step = RunnableLambda(call_roberta)  # 👈 your working roberta call!
+
+# Step 5 - LCEL chain with RunnableLambda wrapping roberta!
 chain = (
     {
-        "context": retriever | format_docs,
+        "docs": retriever,
         "question": RunnablePassthrough()
     }
-    | RunnableLambda(call_roberta)  # 👈 your working roberta call!
+    | RunnableLambda(select_context)
+    | answer_step
 )
 
 
+def answer_from_notes(question: str, texts: list, query_vector: Optional[list] = None) -> str:
+    """
+    Run only the answer step over notes that were already retrieved
+    (used by /api/chat, which does its own user-filtered search).
+
+    Args:
+        question: The user's question
+        texts: Full text of each retrieved note
+        query_vector: The search's embedding of the question, reused for
+                      sentence selection instead of embedding it again
+
+    Raises:
+        DeadlineExceeded: If the request's time budget runs out first
+    """
+    inputs = {"question": question, "context": build_context(question, texts, query_vector=query_vector)}
+    return call_with_deadline("qa_answer", answer_step.invoke, inputs)
+
+
 def ask_question(question: str) -> dict:
     try:
         # ONE line to get the answer! 🎯
-        answer = chain.invoke(question)
+        # (a PROFILE_SAMPLE_RATE fraction of runs is profiled, see profiling.py)
+        with profile_block("chain.invoke", enabled=should_sample()):
+            answer = chain.invoke(question)
         
         print(f"✅ Answer: {answer}")
         return {"answer": answer, "source": "langchain"}
@@ -1,17 +1,41 @@
 import os
+import copy
+import time
+import uuid
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 from dotenv import load_dotenv
 from langchain_huggingface import HuggingFaceEndpointEmbeddings
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_pinecone import PineconeVectorStore
-from langchain_core.documents import Document
+import vector_access
+import recent_writes
+import related_notes
+from note_store import SLIM_VECTOR_METADATA, slim_metadata, save_note_body, hydrate
+from deadlines import call_with_deadline, remaining
 
 load_dotenv()
 
 HF_TOKEN = os.getenv("HF_TOKEN")
 
-EMBEDDING_MODEL = "BAAI/bge-large-en-v1.5"
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "BAAI/bge-large-en-v1.5")
 index = os.getenv("PINECONE_INDEX_NAME")
 
+# Online re-indexing (see reindex.py)
+# REINDEX_TARGET_INDEX: index being migrated to (unset = no migration running)
+# REINDEX_TARGET_MODEL: embedding model used for the target index
+# REINDEX_DUAL_WRITE:   also write new notes to the target index
+# VECTOR_READ_PATH:     "primary" | "shadow" (serve primary, compare with target) | "target"
+REINDEX_TARGET_INDEX = os.getenv("REINDEX_TARGET_INDEX")
+REINDEX_TARGET_MODEL = os.getenv("REINDEX_TARGET_MODEL", EMBEDDING_MODEL)
+REINDEX_DUAL_WRITE = os.getenv("REINDEX_DUAL_WRITE", "false").lower() == "true"
+VECTOR_READ_PATH = os.getenv("VECTOR_READ_PATH", "primary")
+
+# Max vector queries in flight per /api/chat/batch request
+SEARCH_BATCH_CONCURRENCY = int(os.getenv("SEARCH_BATCH_CONCURRENCY", "4"))
+
 # Step 1 - Setup Embedding Model
 embedding_model = HuggingFaceEndpointEmbeddings(
     model=EMBEDDING_MODEL,
@@ -20,11 +44,92 @@ embedding_model = HuggingFaceEndpointEmbeddings(
 print(hasattr(embedding_model, "embed_documents"))
 print(hasattr(embedding_model, "embed_query"))
 # Step 2 - Connect to Pinecone with embedding model attached
+# (used by the LangChain retriever; note reads/writes below go through vector_access)
 vectorstore = PineconeVectorStore(
     index_name=index,
     embedding=embedding_model
 )
 
+# Step 3 - Optional re-index target (new embedding model and/or new index)
+target_embedding_model = None
+if REINDEX_TARGET_INDEX:
+    target_embedding_model = HuggingFaceEndpointEmbeddings(
+        model=REINDEX_TARGET_MODEL,
+        huggingfacehub_api_token=HF_TOKEN
+    )
+    print(f"🔁 Re-index target: {REINDEX_TARGET_INDEX} ({REINDEX_TARGET_MODEL}), "
+          f"dual-write={REINDEX_DUAL_WRITE}, read path={VECTOR_READ_PATH}")
+
+# Shadow reads run off the request path
+_shadow_pool = ThreadPoolExecutor(max_workers=4)
+# Dual-writes to the re-index target too (one thread: two quick saves of a
+# note reach the target in the order they were made)
+_dual_write_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dual-write")
+# Rolling window of shadow comparisons: (overlap, primary_ms, target_ms)
+_shadow_samples = deque(maxlen=1000)
+
+
+def embed_within_deadline(embedder, method: str, payload):
+    """
+    embedder.<method>(payload), with the Hugging Face request timed out at
+    the request's remaining budget. call_with_deadline can only abandon a
+    call; without this, an endpoint cold start keeps the abandoned (and
+    hedged) calls holding upstream threads long after their requests failed.
+    """
+    budget = remaining()
+    if budget is not None and isinstance(embedder, HuggingFaceEndpointEmbeddings):
+        client = copy.copy(embedder.client)  # the shared client is used by other threads
+        client.timeout = max(budget, 0.001)
+        embedder = embedder.model_copy(update={"client": client})
+    return getattr(embedder, method)(payload)
+
+
+def note_id_prefix(user_id: int) -> str:
+    """
+    Vector id prefix shared by all notes of one user.
+    Pinecone can only list ids by prefix, so this is what lets us page
+    through a single user's notes without a similarity search.
+    """
+    return f"{user_id}-"
+
+
+def new_note_id(user_id: int) -> str:
+    """Generate a new note id scoped to the user (e.g. '42-9b1d...')."""
+    return f"{note_id_prefix(user_id)}{uuid.uuid4()}"
+
+
+def normalize_tags(tags) -> list:
+    """Lowercase, trim and de-duplicate tags (keeps first-seen order)."""
+    seen = []
+    for tag in tags or []:
+        tag = str(tag).strip().lower()
+        if tag and tag not in seen:
+            seen.append(tag)
+    return seen
+
+
+def build_note_filter(user_id: int, created_after: Optional[int] = None, created_before: Optional[int] = None, tags: Optional[list] = None) -> dict:
+    """
+    Pinecone metadata filter for a user's notes, optionally narrowed to a
+    time range (epoch seconds, inclusive) and to notes carrying any of `tags`.
+    """
+    filter_dict = {"user_id": {"$eq": user_id}}
+
+    if created_after is not None or created_before is not None:
+        created_range = {}
+        if created_after is not None:
+            created_range["$gte"] = int(created_after)
+        if created_before is not None:
+            created_range["$lte"] = int(created_before)
+        filter_dict["created_ts"] = created_range
+
+    tags = normalize_tags(tags)
+    if tags:
+        filter_dict["tags"] = {"$in": tags}
+
+    return filter_dict
+
+
 def store_note(note_id: str, title: str, content: str, user_id: int, metadata: dict = {}):
     """
     Store a note in Pinecone with user_id for filtering.
@@ -43,25 +148,124 @@ def store_note(note_id: str, title: str, content: str, user_id: int, metadata: d
     # Step 1 - Combine title + content (same as before!)
     combined_text = f"{title}. {content}"
     
-    # Step 2 - Create a Document object
-    doc = Document(
-        page_content=combined_text,
-        metadata={
-            "title": title,
-            "content": content,
-            "text": combined_text,
-            "user_id": user_id,  # ← NEW: Tag note with user ID
-            **metadata  # Include any additional metadata passed in
-        }
-    )
+    # Step 2 - Metadata stored with the vector ("text" is what the LangChain retriever reads)
+    note_metadata = {
+        "title": title,
+        "content": content,
+        "text": combined_text,
+        "user_id": user_id,  # ← NEW: Tag note with user ID
+        **metadata  # Include any additional metadata passed in
+    }
     
-    # Step 3 - LangChain handles embed + store in ONE line!
-    vectorstore.add_documents([doc], ids=[note_id])
-    print(f"✅ Note '{note_id}' stored via LangChain!")
+    # Slim mode: the body goes to Postgres (first, so a search never finds a
+    # vector without its body) and the vector only carries filterable fields
+    vector_metadata = note_metadata
+    if SLIM_VECTOR_METADATA:
+        save_note_body(note_id, user_id, title, content)
+        vector_metadata = slim_metadata(note_metadata)
+
+    # Step 3 - Embed, then write over the shared Pinecone channel
+    # (both bounded by the request deadline; embedding is idempotent so it may be hedged)
+    vector = call_with_deadline("embed_documents", embed_within_deadline, embedding_model, "embed_documents", [combined_text], hedge=True)[0]
+    call_with_deadline("vector_upsert", vector_access.upsert, [{"id": note_id, "values": vector, "metadata": vector_metadata}])
+    print(f"✅ Note '{note_id}' stored!")
+    # Searchable right away, even before the index makes the write visible
+    recent_writes.remember(user_id, note_id, vector, note_metadata)
+    # Patch the related-notes graph in the background (one neighbour query)
+    related_notes.schedule_update(user_id, note_id, vector, title)
+
+    # Step 4 - Dual-write to the re-index target while a migration is running
+    # (in the background: the save doesn't wait for a second embedding)
+    if REINDEX_DUAL_WRITE and target_embedding_model is not None:
+        _dual_write_pool.submit(_dual_write, note_id, user_id, combined_text, vector_metadata, note_metadata)
     return True
 
+
+def _dual_write(note_id: str, user_id: int, combined_text: str, vector_metadata: dict, note_metadata: dict):
+    """Embed and write one note to the re-index target (never raises)."""
+    try:
+        target_vector = target_embedding_model.embed_documents([combined_text])[0]
+        vector_access.upsert(
+            [{"id": note_id, "values": target_vector, "metadata": vector_metadata}],
+            index_name=REINDEX_TARGET_INDEX
+        )
+        recent_writes.remember(user_id, note_id, target_vector, note_metadata, index_name=REINDEX_TARGET_INDEX)
+    except Exception as e:
+        # The primary write succeeded; re-running reindex.py repairs the target
+        print(f"⚠️ Dual-write of '{note_id}' to {REINDEX_TARGET_INDEX} failed: {e}")
+
+
+def _serving_path():
+    """(embedder, index_name) that searches are answered from (index_name None = primary)."""
+    if VECTOR_READ_PATH == "target" and target_embedding_model is not None:
+        return target_embedding_model, REINDEX_TARGET_INDEX
+    return embedding_model, None
+
+
+def _query_index(query_vector: list, top_k: int, filter_dict: dict, index_name: Optional[str]) -> list:
+    """Vector query - idempotent, so it is hedged and bounded by the request deadline."""
+    return call_with_deadline(
+        "vector_query", vector_access.query, query_vector, top_k,
+        filter=filter_dict, index_name=index_name, timeout=remaining(), hedge=True
+    )
+
+
+def _timed_search(embedder, index_name: Optional[str], query: str, top_k: int, filter_dict: dict):
+    """Embed the query, search one index and return (matches, elapsed_ms)."""
+    started = time.perf_counter()
+    query_vector = call_with_deadline("embed_query", embed_within_deadline, embedder, "embed_query", query, hedge=True)
+    results = _query_index(query_vector, top_k, filter_dict, index_name)
+    return results, (time.perf_counter() - started) * 1000
+
+
+def _record_shadow_read(primary_ids: list, primary_ms: float, shadow_future):
+    """Compare the primary results with the shadow (target) results once they arrive."""
+    def compare(future):
+        try:
+            shadow_results, target_ms = future.result()
+        except Exception as e:
+            print(f"⚠️ Shadow read failed: {e}")
+            return
+        target_ids = [match["id"] for match in shadow_results]
+        overlap = len(set(primary_ids) & set(target_ids)) / max(len(primary_ids), 1)
+        _shadow_samples.append((overlap, primary_ms, target_ms))
+        print(f"   🔁 Shadow read: top-k overlap {overlap:.0%}, "
+              f"primary {primary_ms:.0f} ms vs target {target_ms:.0f} ms")
+        if len(_shadow_samples) % 100 == 0:
+            print(f"   🔁 Shadow read report: {shadow_read_report()}")
+
+    shadow_future.add_done_callback(compare)
+
+
+def shadow_read_report() -> dict:
+    """
+    Summarise the shadow reads collected so far (use before flipping
+    VECTOR_READ_PATH to "target").
+
+    Returns:
+        dict: sample count, mean top-k overlap and p50/p95 latency per index
+    """
+    samples = list(_shadow_samples)
+    if not samples:
+        return {"samples": 0}
+
+    def percentile(values, pct):
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+    primary_ms = [s[1] for s in samples]
+    target_ms = [s[2] for s in samples]
+    return {
+        "samples": len(samples),
+        "mean_overlap": sum(s[0] for s in samples) / len(samples),
+        "primary_p50_ms": percentile(primary_ms, 0.50),
+        "primary_p95_ms": percentile(primary_ms, 0.95),
+        "target_p50_ms": percentile(target_ms, 0.50),
+        "target_p95_ms": percentile(target_ms, 0.95)
+    }
+
 # ✅ CHANGED: Added user_id parameter and metadata filtering
-def search_notes(query: str, user_id: int, top_k: int = 3) -> dict:
+def search_notes(query: str, user_id: int, top_k: int = 3, created_after: Optional[int] = None, created_before: Optional[int] = None, tags: Optional[list] = None) -> dict:
     """
     Search notes in Pinecone filtered by user_id.
     Each user only sees their own notes.
@@ -70,31 +274,127 @@ def search_notes(query: str, user_id: int, top_k: int = 3) -> dict:
         query: Search query string
         user_id: ID of the user performing the search (NEW!)
         top_k: Number of results to return
+        created_after: Only notes created at/after this epoch second
+        created_before: Only notes created at/before this epoch second
+        tags: Only notes with at least one of these tags
     
     Returns:
         dict: Contains 'matches' and 'answer' for LLM context
+
+    Raises:
+        DeadlineExceeded: If the request's time budget runs out mid-search
     """
     
     # ✅ NEW: Create metadata filter to only search this user's notes
     # This is the KEY change - Pinecone will only return notes where user_id matches
-    filter_dict = {"user_id": {"$eq": user_id}}
+    # (time range and tags are filtered inside the index as well)
+    filter_dict = build_note_filter(user_id, created_after, created_before, tags)
     
-    # ✅ CHANGED: Added filter parameter to similarity_search
-    # LangChain handles embed + search + filter in ONE line!
-    results = vectorstore.similarity_search(
-        query, 
-        k=top_k,
-        filter=filter_dict  # ← NEW: Only search this user's notes!
-    )
+    # Shadow mode: fire the same query at the target index in the background
+    shadow_future = None
+    if VECTOR_READ_PATH == "shadow" and target_embedding_model is not None:
+        shadow_future = _shadow_pool.submit(
+            _timed_search, target_embedding_model, REINDEX_TARGET_INDEX, query, top_k, filter_dict
+        )
+
+    # ✅ CHANGED: Added filter to the query - embed + search + filter
+    embedder, served_index = _serving_path()
+    started = time.perf_counter()
+    query_vector = call_with_deadline("embed_query", embed_within_deadline, embedder, "embed_query", query, hedge=True)
+    results = _query_index(query_vector, top_k, filter_dict, served_index)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    if shadow_future is not None:
+        _record_shadow_read([match["id"] for match in results], elapsed_ms, shadow_future)
+
+    return _finish_search(user_id, query_vector, results, top_k, filter_dict, served_index)
+
+
+def embed_search_query(query: str) -> Tuple[list, Optional[str]]:
+    """
+    Embed step of search_notes.
+
+    Returns:
+        tuple: (query_vector, index_name) - pass both to search_notes_by_vector
+    """
+    embedder, served_index = _serving_path()
+    return call_with_deadline("embed_query", embed_within_deadline, embedder, "embed_query", query, hedge=True), served_index
+
+
+def search_notes_by_vector(query_vector: list, user_id: int, top_k: int, filter_dict: dict, index_name: Optional[str] = None) -> dict:
+    """
+    Search step of search_notes for a query that is already embedded
+    (same result shape as search_notes).
+    """
+    results = _query_index(query_vector, top_k, filter_dict, index_name)
+    return _finish_search(user_id, query_vector, results, top_k, filter_dict, index_name)
+
+
+def search_notes_batch(queries: List[str], user_id: int, top_k: int = 3, created_after: Optional[int] = None, created_before: Optional[int] = None, tags: Optional[list] = None) -> list:
+    """
+    Search several questions at once: ONE embedding call for all of them,
+    then the vector queries run concurrently (at most SEARCH_BATCH_CONCURRENCY
+    at a time).
+
+    Args:
+        queries: Search query strings
+        user_id: ID of the user performing the search
+        top_k, created_after, created_before, tags: As in search_notes, applied to every query
+
+    Returns:
+        list: One entry per query, in order - the search_notes result dict,
+              or {"error": "..."} if that query's search failed
+
+    Raises:
+        DeadlineExceeded: If the time budget runs out during the shared embedding call
+    """
+    if not queries:
+        return []
+
+    filter_dict = build_note_filter(user_id, created_after, created_before, tags)
+    embedder, served_index = _serving_path()
+
+    # Step 1 - Embed every question in a single round-trip
+    query_vectors = call_with_deadline("embed_documents", embed_within_deadline, embedder, "embed_documents", list(queries), hedge=True)
+
+    # Step 2 - Fan out the vector queries (each thread keeps the request's deadline)
+    with ThreadPoolExecutor(max_workers=min(SEARCH_BATCH_CONCURRENCY, len(queries))) as pool:
+        futures = [
+            pool.submit(
+                contextvars.copy_context().run,
+                search_notes_by_vector, query_vector, user_id, top_k, filter_dict, served_index
+            )
+            for query_vector in query_vectors
+        ]
+
+        results = []
+        for query, future in zip(queries, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"⚠️ Batch search failed for '{query}': {e}")
+                results.append({"error": str(e) or type(e).__name__})
+    return results
+
+
+def _finish_search(user_id: int, query_vector: list, results: list, top_k: int, filter_dict: dict, index_name: Optional[str]) -> dict:
+    """Merge recent writes, hydrate bodies and shape raw matches into the search_notes result."""
+    # Read-your-writes: add notes saved moments ago that the index doesn't return yet
+    results = recent_writes.merge(user_id, query_vector, results, top_k, filter_dict, index_name=index_name)
+    # Slim vectors: fetch the bodies of the top-k from Postgres / the LRU
+    results = hydrate(results)
     
     matches = []
-    for doc in results:
+    for result in results:
+        metadata = result["metadata"]
         matches.append({
-            "title": doc.metadata.get('title', ''),
-            "content": doc.metadata.get('content', ''),
-            "text": doc.page_content
+            "id": result["id"],
+            "score": result["score"],
+            "title": metadata.get('title', ''),
+            "content": metadata.get('content', ''),
+            "text": metadata.get('text', '')
         })
-        print(f"   Found for user {user_id}: {doc.metadata.get('title', '')}")
+        print(f"   Found for user {user_id}: {metadata.get('title', '')} (score: {result['score']:.2f})")
     
     # ✅ NEW: Return structured response with answer context
     if matches:
@@ -110,5 +410,7 @@ def search_notes(query: str, user_id: int, top_k: int = 3) -> dict:
     return {
         "matches": matches,
         "answer": answer,
-        "count": len(matches)
+        "count": len(matches),
+        # Reusable by build_context only if it came from embedding_model (primary index)
+        "query_vector": query_vector if index_name is None else None
     }
\ No newline at end of file
@@ -2,13 +2,20 @@ import os
 from dotenv import load_dotenv
 import requests
 from pinecone_service import store_note, search_notes
+from context_builder import build_context
 
 load_dotenv()
 
 HF_TOKEN = os.getenv("HF_TOKEN")
 HF_MODEL_URL = "https://router.huggingface.co/hf-inference/models/deepset/roberta-base-squad2"
+QA_BACKEND = os.getenv("QA_BACKEND", "remote")
 
 def call_huggingface(prompt: str, context: str = "") -> str:
+    if QA_BACKEND == "local" and "roberta" in HF_MODEL_URL:
+        # Same roberta model, answered on this machine instead of the hosted endpoint
+        from local_qa_service import answer_question
+        return answer_question(prompt, context or prompt)["answer"]
+
     headers = {"Authorization": f"Bearer {HF_TOKEN}"}
     
     if "roberta" in HF_MODEL_URL:
@@ -45,10 +52,9 @@ def ask_question_langchain(question: str) -> dict:
     try:
         relevant_notes = search_notes(question, top_k=3)
         
-        # Format context for roberta - just plain text without bullets
-        if relevant_notes:
-            context = " ".join([n['text'] for n in relevant_notes])
-        else:
+        # Format context for roberta - only the most relevant sentences, within its token budget
+        context = build_context(question, [n['text'] for n in relevant_notes])
+        if not context:
             context = "No relevant notes found."
         
         answer = call_huggingface(question, context)
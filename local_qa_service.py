@@ -0,0 +1,404 @@
+import os
+import json
+import time
+import queue
+import threading
+from concurrent.futures import Future
+import torch
+from torch import nn
+import torch.nn.functional as F
+from huggingface_hub import hf_hub_download
+from huggingface_hub.utils import EntryNotFoundError
+from tokenizers import Tokenizer, models, pre_tokenizers, decoders, processors
+from dotenv import load_dotenv
+import deadlines
+
+load_dotenv()
+
+HF_TOKEN = os.getenv("HF_TOKEN")
+
+# Local extractive QA - same model as the hosted roberta endpoint, run on CPU
+QA_MODEL = os.getenv("QA_MODEL", "deepset/roberta-base-squad2")
+QA_MAX_SEQ_LEN = int(os.getenv("QA_MAX_SEQ_LEN", "384"))         # tokens per window
+QA_DOC_STRIDE = int(os.getenv("QA_DOC_STRIDE", "128"))           # overlap between windows
+QA_MAX_ANSWER_TOKENS = int(os.getenv("QA_MAX_ANSWER_TOKENS", "30"))
+QA_QUANTIZE = os.getenv("QA_QUANTIZE", "false").lower() == "true"  # dynamic int8 Linear layers
+QA_MAX_BATCH = int(os.getenv("QA_MAX_BATCH", "16"))              # windows per forward pass
+QA_BATCH_WAIT_MS = float(os.getenv("QA_BATCH_WAIT_MS", "5"))     # wait for more questions to batch
+
+
+# ============ MODEL (RoBERTa encoder + span head) ============
+# Module and attribute names mirror the Hugging Face checkpoint keys,
+# so the published weights load straight into these modules.
+
+class RobertaEmbeddings(nn.Module):
+    def __init__(self, config: dict):
+        super().__init__()
+        hidden = config["hidden_size"]
+        self.padding_idx = config["pad_token_id"]
+        self.word_embeddings = nn.Embedding(config["vocab_size"], hidden, padding_idx=self.padding_idx)
+        self.position_embeddings = nn.Embedding(config["max_position_embeddings"], hidden, padding_idx=self.padding_idx)
+        self.token_type_embeddings = nn.Embedding(config["type_vocab_size"], hidden)
+        self.LayerNorm = nn.LayerNorm(hidden, eps=config["layer_norm_eps"])
+
+    def forward(self, input_ids):
+        # RoBERTa positions start after the padding index and skip padding tokens
+        mask = input_ids.ne(self.padding_idx).int()
+        position_ids = torch.cumsum(mask, dim=1) * mask + self.padding_idx
+        embeddings = (
+            self.word_embeddings(input_ids)
+            + self.position_embeddings(position_ids)
+            + self.token_type_embeddings(torch.zeros_like(input_ids))
+        )
+        return self.LayerNorm(embeddings)
+
+
+class RobertaSelfAttention(nn.Module):
+    def __init__(self, config: dict):
+        super().__init__()
+        hidden = config["hidden_size"]
+        self.num_heads = config["num_attention_heads"]
+        self.query = nn.Linear(hidden, hidden)
+        self.key = nn.Linear(hidden, hidden)
+        self.value = nn.Linear(hidden, hidden)
+
+    def forward(self, hidden_states, attention_mask):
+        batch, seq_len, hidden = hidden_states.shape
+        head_dim = hidden // self.num_heads
+
+        def split_heads(x):
+            return x.view(batch, seq_len, self.num_heads, head_dim).transpose(1, 2)
+
+        context = F.scaled_dot_product_attention(
+            split_heads(self.query(hidden_states)),
+            split_heads(self.key(hidden_states)),
+            split_heads(self.value(hidden_states)),
+            attn_mask=attention_mask
+        )
+        return context.transpose(1, 2).reshape(batch, seq_len, hidden)
+
+
+class RobertaSelfOutput(nn.Module):
+    def __init__(self, config: dict):
+        super().__init__()
+        self.dense = nn.Linear(config["hidden_size"], config["hidden_size"])
+        self.LayerNorm = nn.LayerNorm(config["hidden_size"], eps=config["layer_norm_eps"])
+
+    def forward(self, hidden_states, input_tensor):
+        return self.LayerNorm(self.dense(hidden_states) + input_tensor)
+
+
+class RobertaAttention(nn.Module):
+    def __init__(self, config: dict):
+        super().__init__()
+        self.self = RobertaSelfAttention(config)
+        self.output = RobertaSelfOutput(config)
+
+    def forward(self, hidden_states, attention_mask):
+        return self.output(self.self(hidden_states, attention_mask), hidden_states)
+
+
+class RobertaIntermediate(nn.Module):
+    def __init__(self, config: dict):
+        super().__init__()
+        self.dense = nn.Linear(config["hidden_size"], config["intermediate_size"])
+
+    def forward(self, hidden_states):
+        return F.gelu(self.dense(hidden_states))
+
+
+class RobertaOutput(nn.Module):
+    def __init__(self, config: dict):
+        super().__init__()
+        self.dense = nn.Linear(config["intermediate_size"], config["hidden_size"])
+        self.LayerNorm = nn.LayerNorm(config["hidden_size"], eps=config["layer_norm_eps"])
+
+    def forward(self, hidden_states, input_tensor):
+        return self.LayerNorm(self.dense(hidden_states) + input_tensor)
+
+
+class RobertaLayer(nn.Module):
+    def __init__(self, config: dict):
+        super().__init__()
+        self.attention = RobertaAttention(config)
+        self.intermediate = RobertaIntermediate(config)
+        self.output = RobertaOutput(config)
+
+    def forward(self, hidden_states, attention_mask):
+        attention_output = self.attention(hidden_states, attention_mask)
+        return self.output(self.intermediate(attention_output), attention_output)
+
+
+class RobertaEncoder(nn.Module):
+    def __init__(self, config: dict):
+        super().__init__()
+        self.layer = nn.ModuleList([RobertaLayer(config) for _ in range(config["num_hidden_layers"])])
+
+    def forward(self, hidden_states, attention_mask):
+        for layer in self.layer:
+            hidden_states = layer(hidden_states, attention_mask)
+        return hidden_states
+
+
+class RobertaModel(nn.Module):
+    def __init__(self, config: dict):
+        super().__init__()
+        self.embeddings = RobertaEmbeddings(config)
+        self.encoder = RobertaEncoder(config)
+
+    def forward(self, input_ids):
+        # (batch, 1, 1, seq) boolean mask: True = real token, may be attended to
+        attention_mask = input_ids.ne(self.embeddings.padding_idx)[:, None, None, :]
+        return self.encoder(self.embeddings(input_ids), attention_mask)
+
+
+class RobertaForQuestionAnswering(nn.Module):
+    def __init__(self, config: dict):
+        super().__init__()
+        self.roberta = RobertaModel(config)
+        self.qa_outputs = nn.Linear(config["hidden_size"], 2)
+
+    def forward(self, input_ids):
+        logits = self.qa_outputs(self.roberta(input_ids))
+        start_logits, end_logits = logits.unbind(dim=-1)
+        return start_logits, end_logits
+
+
+# ============ LOADING ============
+
+_model = None
+_tokenizer = None
+_load_lock = threading.Lock()
+
+
+def _download(filename: str) -> str:
+    return hf_hub_download(QA_MODEL, filename, token=HF_TOKEN)
+
+
+def _load_state_dict() -> dict:
+    """Load the checkpoint weights (safetensors when published, else the torch pickle)."""
+    try:
+        from safetensors.torch import load_file
+        state_dict = load_file(_download("model.safetensors"))
+    except EntryNotFoundError:
+        state_dict = torch.load(_download("pytorch_model.bin"), map_location="cpu", weights_only=True)
+
+    # Older checkpoints name LayerNorm parameters gamma/beta
+    return {
+        key.replace("LayerNorm.gamma", "LayerNorm.weight").replace("LayerNorm.beta", "LayerNorm.bias"): value
+        for key, value in state_dict.items()
+    }
+
+
+def _load_tokenizer() -> Tokenizer:
+    """Fast tokenizer from tokenizer.json, or rebuilt from vocab.json + merges.txt."""
+    try:
+        tokenizer = Tokenizer.from_file(_download("tokenizer.json"))
+    except EntryNotFoundError:
+        tokenizer = Tokenizer(models.BPE.from_file(_download("vocab.json"), _download("merges.txt")))
+        tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+        tokenizer.decoder = decoders.ByteLevel()
+        tokenizer.post_processor = processors.RobertaProcessing(
+            sep=("</s>", tokenizer.token_to_id("</s>")),
+            cls=("<s>", tokenizer.token_to_id("<s>")),
+            trim_offsets=True
+        )
+
+    # Long contexts become several overlapping windows (Encoding.overflowing)
+    tokenizer.no_padding()
+    tokenizer.enable_truncation(max_length=QA_MAX_SEQ_LEN, stride=QA_DOC_STRIDE, strategy="only_second")
+    return tokenizer
+
+
+def load_model():
+    """
+    Load the tokenizer and weights once per process.
+    server.py calls this before forking so all workers share the weights.
+    """
+    global _model, _tokenizer
+    with _load_lock:
+        if _model is not None:
+            return
+
+        started = time.perf_counter()
+        with open(_download("config.json")) as f:
+            config = json.load(f)
+
+        model = RobertaForQuestionAnswering(config)
+        missing, _ = model.load_state_dict(_load_state_dict(), strict=False)
+        if missing:
+            raise RuntimeError(f"{QA_MODEL} checkpoint is missing weights: {missing[:5]}")
+        model.eval()
+
+        if QA_QUANTIZE:
+            model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+        _tokenizer = _load_tokenizer()
+        _model = model
+        print(f"✅ Local QA model {QA_MODEL} loaded in {time.perf_counter() - started:.1f}s "
+              f"(int8={QA_QUANTIZE})")
+
+
+# ============ INFERENCE ============
+
+def _best_span(start_logits, end_logits, context_mask):
+    """
+    Best (start, end, score) answer span inside the context tokens of one window.
+    Scores every start/end pair at once instead of looping over top-n candidates.
+    """
+    seq_len = start_logits.shape[0]
+    scores = start_logits[:, None] + end_logits[None, :]
+
+    # end >= start, span no longer than QA_MAX_ANSWER_TOKENS, both ends inside the context
+    positions = torch.arange(seq_len)
+    span_length = positions[None, :] - positions[:, None]
+    valid = (span_length >= 0) & (span_length < QA_MAX_ANSWER_TOKENS)
+    valid &= context_mask[:, None] & context_mask[None, :]
+    scores = scores.masked_fill(~valid, float("-inf"))
+
+    best = int(torch.argmax(scores))
+    start, end = divmod(best, seq_len)
+    return start, end, float(scores[start, end])
+
+
+def _best_answer(context: str, windows: list, start_logits: list, end_logits: list) -> dict:
+    """
+    Best answer over all windows of one question.
+
+    Args:
+        context: The original context text
+        windows: Its encodings (first window + overflowing ones)
+        start_logits, end_logits: Per-window logits (padding may follow each window's tokens)
+
+    Returns:
+        dict: answer text, span score and character offsets in `context`
+    """
+    best = {"answer": "", "score": float("-inf"), "start": 0, "end": 0}
+    for window, window_start, window_end in zip(windows, start_logits, end_logits):
+        length = len(window.ids)
+        context_mask = torch.tensor([sid == 1 for sid in window.sequence_ids])
+        start, end, score = _best_span(window_start[:length], window_end[:length], context_mask)
+        if score > best["score"]:
+            # Offsets of every window point into the original context string
+            char_start, char_end = window.offsets[start][0], window.offsets[end][1]
+            best = {
+                "answer": context[char_start:char_end].strip(),
+                "score": score,
+                "start": char_start,
+                "end": char_end
+            }
+    return best
+
+
+def _run_batch(items: list):
+    """Run one forward pass over the windows of several questions and resolve their futures."""
+    windows = [window for item in items for window in item["windows"]]
+    pad_id = _model.roberta.embeddings.padding_idx
+
+    start_all, end_all = [], []
+    with torch.inference_mode():
+        for i in range(0, len(windows), QA_MAX_BATCH):
+            chunk = windows[i:i + QA_MAX_BATCH]
+            seq_len = max(len(w.ids) for w in chunk)
+            input_ids = torch.full((len(chunk), seq_len), pad_id, dtype=torch.long)
+            for row, window in enumerate(chunk):
+                input_ids[row, :len(window.ids)] = torch.tensor(window.ids)
+            start_logits, end_logits = _model(input_ids)
+            start_all.extend(start_logits)
+            end_all.extend(end_logits)
+
+    position = 0
+    for item in items:
+        count = len(item["windows"])
+        best = _best_answer(
+            item["context"], item["windows"],
+            start_all[position:position + count], end_all[position:position + count]
+        )
+        position += count
+        item["future"].set_result(best)
+
+
+class QABatcher:
+    """
+    Collects questions arriving concurrently from many request threads and
+    answers them together in one forward pass (up to QA_MAX_BATCH windows,
+    waiting at most QA_BATCH_WAIT_MS for the batch to fill).
+    """
+
+    def __init__(self):
+        self.requests = queue.Queue()
+        self.thread = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def _ensure_running(self):
+        # Started lazily - and again after a fork, since threads don't survive it
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid():
+                self.requests = queue.Queue()
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self._loop, name="qa-batcher", daemon=True)
+                self.thread.start()
+
+    def submit(self, question: str, context: str) -> Future:
+        load_model()
+        self._ensure_running()
+
+        # Tokenize on the caller's thread; only the forward pass is serialized
+        encoding = _tokenizer.encode(question, context)
+        future = Future()
+        self.requests.put({
+            "context": context,
+            "windows": [encoding] + encoding.overflowing,
+            "future": future
+        })
+        return future
+
+    def _loop(self):
+        while True:
+            items = [self.requests.get()]
+            num_windows = len(items[0]["windows"])
+            deadline = time.monotonic() + QA_BATCH_WAIT_MS / 1000
+
+            while num_windows < QA_MAX_BATCH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                items.append(item)
+                num_windows += len(item["windows"])
+
+            try:
+                _run_batch(items)
+            except Exception as e:
+                for item in items:
+                    if not item["future"].done():
+                        item["future"].set_exception(e)
+
+
+_batcher = QABatcher()
+
+
+def answer_question(question: str, context: str, timeout: float = None) -> dict:
+    """
+    Extract the answer to `question` from `context` with the local model.
+
+    Args:
+        question: The user's question
+        context: Text to search for the answer (any length - long contexts
+                 are split into overlapping windows)
+        timeout: Max seconds to wait for the answer
+
+    Returns:
+        dict: answer text, span score and character offsets in the context
+    """
+    return _batcher.submit(question, context).result(timeout=timeout)
+
+
+def call_local_qa(input: dict) -> str:
+    """Drop-in replacement for call_roberta (same input/output shape)."""
+    result = answer_question(input["question"], input["context"], timeout=deadlines.remaining())
+    return result["answer"] or "I couldn't find an answer!"
@@ -1,18 +1,46 @@
 # main.py
-from langchain_pinecone_service import store_note, search_notes
-from fastapi import FastAPI, Depends, HTTPException, status
-from dependencies import get_current_user
-from models import User
+from langchain_pinecone_service import store_note, search_notes, search_notes_batch, new_note_id, note_id_prefix, normalize_tags
+from export_service import export_notes_ndjson, export_notes_binary
+from server import read_worker_states
+from related_notes import get_related
+from import_service import ImportTooLarge, import_format, create_import_job, start_import, resume_import, import_status
+from profiling import PROFILE_HEADER, is_admin, should_sample, start_profile, finish_profile, list_profiles, profile_path
+from jwt_utils import verify_access_token
+from langchain_llm_service import answer_from_notes
+from deadlines import DEADLINE_HEADER, DeadlineExceeded, deadline_for, set_deadline, reset_deadline, remaining
+from dedupe_service import (
+    NEAR_DUPLICATE_POLICY,
+    fingerprint,
+    find_duplicate,
+    record_fingerprint,
+    IdempotencyConflict,
+    reserve_idempotency_key,
+    complete_idempotency_key,
+    release_idempotency_key,
+)
+from fastapi import FastAPI, Depends, File, Header, HTTPException, Query, Request, UploadFile, status
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from sqlalchemy.orm import Session
+from database import get_db
+from dependencies import get_current_user, get_admin_user
+from models import User, ImportJob
 from auth import router as auth_router
+from ws_chat import router as ws_chat_router
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import List, Optional
 import os
-import uuid
+import asyncio
+import zipfile
 from datetime import datetime
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Don't start the answer step with less than this much of the budget left
+ANSWER_MIN_BUDGET_MS = int(os.getenv("ANSWER_MIN_BUDGET_MS", "1500"))
+# Max questions per /api/chat/batch request
+MAX_CHAT_BATCH = int(os.getenv("MAX_CHAT_BATCH", "20"))
 
 app = FastAPI(
     title="BrainVault API", 
@@ -30,6 +58,66 @@ app.add_middleware(
 
 # Include authentication routes
 app.include_router(auth_router)
+# WebSocket chat (/ws/chat)
+app.include_router(ws_chat_router)
+
+
+# ============ REQUEST DEADLINES ============
+
+@app.middleware("http")
+async def request_deadline(request: Request, call_next):
+    """
+    Give every request a time budget (X-Request-Timeout-Ms header, or the
+    endpoint's default). Upstream calls made while handling it only get
+    what is left of the budget.
+    """
+    token = set_deadline(deadline_for(request.url.path, request.headers.get(DEADLINE_HEADER)))
+    try:
+        return await call_next(request)
+    finally:
+        reset_deadline(token)
+
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    print(f"⏱️ Deadline exceeded on {request.url.path}: {exc}")
+    return JSONResponse(status_code=status.HTTP_504_GATEWAY_TIMEOUT, content={"detail": str(exc)})
+
+
+# ============ PROFILING (admin-only) ============
+
+def _profiling_requested(request: Request) -> bool:
+    """An admin asked for a profile with the X-Profile header or ?profile=1."""
+    flag = request.headers.get(PROFILE_HEADER) or request.query_params.get("profile")
+    if flag not in ("1", "true"):
+        return False
+    authorization = request.headers.get("authorization", "")
+    if not authorization.lower().startswith("bearer "):
+        return False
+    # Admins are identified by email, so the token alone is enough (no DB lookup)
+    return is_admin(verify_access_token(authorization[7:]))
+
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    """
+    Run the sampling profiler around requests an admin asked to profile,
+    plus a random PROFILE_SAMPLE_RATE fraction of all traffic.
+    Results are listed at GET /admin/profiles.
+    """
+    if not (_profiling_requested(request) or should_sample()):
+        return await call_next(request)
+
+    profiler = start_profile()
+    if profiler is None:  # another request is being profiled in this worker
+        return await call_next(request)
+    try:
+        response = await call_next(request)
+    finally:
+        name = await asyncio.to_thread(finish_profile, profiler, f"{request.method} {request.url.path}")
+    if name:
+        response.headers["X-Profile-Id"] = name
+    return response
 
 
 # ============ REQUEST/RESPONSE SCHEMAS ============
@@ -37,11 +125,37 @@ app.include_router(auth_router)
 class ChatRequest(BaseModel):
     """Schema for chat requests"""
     message: str
+    created_after: Optional[datetime] = None   # only notes created at/after this time
+    created_before: Optional[datetime] = None  # only notes created at/before this time
+    tags: Optional[List[str]] = None           # only notes with any of these tags
+    generate_answer: bool = False              # also extract an answer from the matched notes
 
 
 class ChatResponse(BaseModel):
     """Schema for chat responses"""
     reply: str
+    answer: Optional[str] = None   # only when generate_answer was requested
+    degraded: bool = False         # answer skipped (time budget ran out or the answer step failed)
+
+
+class ChatBatchRequest(BaseModel):
+    """Schema for batch chat requests (filters apply to every message)"""
+    messages: List[str]
+    created_after: Optional[datetime] = None
+    created_before: Optional[datetime] = None
+    tags: Optional[List[str]] = None
+
+
+class ChatBatchItem(BaseModel):
+    """Result for one message of a batch - either a reply or an error"""
+    reply: Optional[str] = None
+    count: int = 0
+    error: Optional[str] = None
+
+
+class ChatBatchResponse(BaseModel):
+    """Schema for batch chat responses (same order as the request's messages)"""
+    results: List[ChatBatchItem]
 
 
 # ============ PUBLIC ENDPOINTS ============
@@ -55,15 +169,28 @@ def read_root():
 @app.get("/health")
 def health_check():
     """Public endpoint - no authentication required""" 
-    return {"status": "healthy"}
+    return {"status": "healthy", "pid": os.getpid()}
+
+
+@app.get("/health/workers")
+def workers_health():
+    """
+    Public endpoint - health of every worker process started by server.py
+    (heartbeat, readiness and request counts per worker).
+    """
+    workers = read_worker_states()
+    all_healthy = bool(workers) and all(w["healthy"] for w in workers)
+    return {"status": "healthy" if all_healthy else "degraded", "workers": workers}
 
 
 # ============ PROTECTED ENDPOINTS (USER-SPECIFIC) ============
 
 @app.post("/api/notes")
-async def save_note(
+def save_note(
     request: dict,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     """
     Save a note (protected endpoint - user-specific).
@@ -72,13 +199,24 @@ async def save_note(
     Expected request body:
     {
         "title": "Note title",
-        "content": "Note content"
+        "content": "Note content",
+        "tags": ["work", "meetings"]    (optional)
     }
+
+    Optional header:
+        Idempotency-Key: retries with the same key return the first result
+        instead of saving the note again (a retry that arrives while the
+        first attempt is still running waits for its result). A retry after
+        a failed or timed-out attempt stores the note under the same id.
+
+    Exact duplicates of an existing note are not stored again; near
+    duplicates are handled according to NEAR_DUPLICATE_POLICY.
     """
     print(f"User {current_user.email} (ID: {current_user.id}) is saving a note")
     
     title = request.get("title")
     content = request.get("content")
+    tags = request.get("tags") or []
     
     # Validation
     if not title or not content:
@@ -86,28 +224,89 @@ async def save_note(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Both 'title' and 'content' fields are required"
         )
+    if not isinstance(tags, list):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="'tags' must be a list of strings"
+        )
     
-    # Generate unique ID
-    note_id = str(uuid.uuid4())
+    # Retried request? Claim the key first, so concurrent retries can't both
+    # save the note - a retry that loses waits for the first result instead.
+    # The note id is fixed with the reservation (prefixed with the user ID so
+    # notes can be listed per user)
+    try:
+        reservation = reserve_idempotency_key(db, current_user.id, idempotency_key, new_note_id(current_user.id))
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    if reservation.completed:
+        return {
+            "message": "Note saved successfully!",
+            "note_id": reservation.note_id,
+            "user": current_user.email
+        }
+
+    try:
+        return _store_user_note(db, current_user, title, content, tags, idempotency_key, reservation.note_id)
+    except Exception:
+        # The write may still land (e.g. after a deadline) - the client's retry
+        # takes the key over and writes the same note id again
+        release_idempotency_key(db, current_user.id, idempotency_key)
+        raise
+
+
+def _store_user_note(db: Session, current_user: User, title: str, content: str, tags: list, idempotency_key: Optional[str], reserved_note_id: str) -> dict:
+    """Dedupe, embed and store one note (save_note, after the Idempotency-Key is reserved)."""
+    # Duplicate check BEFORE paying for an embedding
+    fp = fingerprint(title, content)
+    duplicate, existing_note_id = find_duplicate(db, current_user.id, fp)
+
+    if duplicate == "exact" or (duplicate == "near" and NEAR_DUPLICATE_POLICY == "link"):
+        print(f"   Skipping {duplicate} duplicate of note {existing_note_id}")
+        complete_idempotency_key(db, current_user.id, idempotency_key, existing_note_id)
+        return {
+            "message": "Note already saved",
+            "note_id": existing_note_id,
+            "user": current_user.email,
+            "duplicate": duplicate
+        }
+
+    if duplicate == "near":
+        # NEAR_DUPLICATE_POLICY == "update": overwrite the existing note in place
+        print(f"   Updating near duplicate note {existing_note_id} in place")
+        note_id = existing_note_id
+    else:
+        note_id = reserved_note_id
     
     # ✅ Store with user_id - CRITICAL for user-specific filtering
+    now = datetime.now()
+    metadata = {
+        "created_at": now.isoformat(),
+        "created_ts": int(now.timestamp()),  # numeric, for time-range filters
+        "user_email": current_user.email  # Optional: For debugging
+    }
+    tags = normalize_tags(tags)
+    if tags:
+        metadata["tags"] = tags
+
     success = store_note(
         note_id=note_id,
         title=title,
         content=content,
         user_id=current_user.id,  # ← Pass user ID!
-        metadata={
-            "created_at": datetime.now().isoformat(),
-            "user_email": current_user.email  # Optional: For debugging
-        }
+        metadata=metadata
     )
     
     if success:
-        return {
+        record_fingerprint(db, current_user.id, note_id, fp)
+        complete_idempotency_key(db, current_user.id, idempotency_key, note_id)
+        response = {
             "message": "Note saved successfully!",
             "note_id": note_id,
             "user": current_user.email
         }
+        if duplicate:
+            response["duplicate"] = duplicate
+        return response
     else:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -116,7 +315,7 @@ async def save_note(
 
 
 @app.post("/api/chat")
-async def chat(
+def chat(
     request: ChatRequest,
     current_user: User = Depends(get_current_user)
 ):
@@ -126,20 +325,257 @@ async def chat(
     
     Expected request body:
     {
-        "message": "What are my meeting notes?"
+        "message": "What are my meeting notes?",
+        "created_after": "2026-01-01T00:00:00",   (optional)
+        "created_before": "2026-01-08T00:00:00",  (optional)
+        "tags": ["work"],                         (optional)
+        "generate_answer": true                   (optional)
     }
+
+    If the time budget runs out (or the answer step fails) before the answer
+    is ready, the retrieval results are still returned, with "degraded": true.
     """
     print(f"User {current_user.email} (ID: {current_user.id}) is searching: {request.message}")
     
     # ✅ Search only this user's notes by passing user_id
     result = search_notes(
         query=request.message,
-        user_id=current_user.id  # ← Pass user ID for filtering!
+        user_id=current_user.id,  # ← Pass user ID for filtering!
+        created_after=request.created_after.timestamp() if request.created_after else None,
+        created_before=request.created_before.timestamp() if request.created_before else None,
+        tags=request.tags
     )
     
     print(f"Search results for user {current_user.id}: {result['count']} matches")
-    
-    return ChatResponse(reply=result["answer"])
+
+    response = ChatResponse(reply=result["answer"])
+    if request.generate_answer and result["matches"]:
+        budget = remaining()
+        if budget is not None and budget * 1000 < ANSWER_MIN_BUDGET_MS:
+            print(f"   ⏱️ Only {budget * 1000:.0f} ms left - skipping the answer step")
+            response.degraded = True
+        else:
+            try:
+                response.answer = answer_from_notes(
+                    request.message,
+                    [m["text"] for m in result["matches"]],
+                    query_vector=result["query_vector"]
+                )
+            except DeadlineExceeded:
+                print("   ⏱️ Answer step ran out of time - returning retrieval results only")
+                response.degraded = True
+            except Exception as e:
+                # The notes were found; a failing answer model shouldn't cost the user those
+                print(f"   ⚠️ Answer step failed ({e!r}) - returning retrieval results only")
+                response.degraded = True
+
+    return response
+
+
+@app.post("/api/chat/batch")
+def chat_batch(
+    request: ChatBatchRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Search notes for several messages in one round-trip (protected endpoint).
+    All messages are embedded together and searched in parallel.
+
+    Expected request body:
+    {
+        "messages": ["What did I plan for today?", "Any open todos?"],
+        "created_after": "2026-01-01T00:00:00",   (optional, applies to all)
+        "created_before": "2026-01-08T00:00:00",  (optional, applies to all)
+        "tags": ["work"]                          (optional, applies to all)
+    }
+
+    Returns one result per message, in order; a message that fails gets an
+    "error" instead of failing the whole batch.
+    """
+    if not request.messages:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="'messages' must contain at least one message"
+        )
+    if len(request.messages) > MAX_CHAT_BATCH:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_CHAT_BATCH} messages per batch"
+        )
+
+    print(f"User {current_user.email} (ID: {current_user.id}) is searching {len(request.messages)} messages")
+
+    items = [ChatBatchItem(error="Empty message") for _ in request.messages]
+    positions = [i for i, message in enumerate(request.messages) if message.strip()]
+
+    results = search_notes_batch(
+        [request.messages[i] for i in positions],
+        user_id=current_user.id,
+        created_after=request.created_after.timestamp() if request.created_after else None,
+        created_before=request.created_before.timestamp() if request.created_before else None,
+        tags=request.tags
+    )
+    for i, result in zip(positions, results):
+        if "error" in result:
+            items[i] = ChatBatchItem(error=result["error"])
+        else:
+            items[i] = ChatBatchItem(reply=result["answer"], count=result["count"])
+
+    return ChatBatchResponse(results=items)
+
+
+@app.get("/api/notes/export")
+def export_notes(
+    format: str = Query("ndjson", pattern="^(ndjson|binary)$"),
+    cursor: Optional[str] = None,
+    include_vectors: bool = True,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Stream all of the current user's notes (backups / GDPR exports).
+
+    Query params:
+        format: "ndjson" (one JSON object per line) or "binary"
+                (packed float32 vectors, see export_service.BINARY_MAGIC)
+        cursor: Resume token from a previous, interrupted export
+        include_vectors: Include the embedding values of each note
+    """
+    print(f"User {current_user.email} (ID: {current_user.id}) is exporting notes ({format})")
+
+    if format == "binary":
+        return StreamingResponse(
+            export_notes_binary(current_user.id, cursor, include_vectors),
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": "attachment; filename=brainvault-notes.bvx"}
+        )
+
+    return StreamingResponse(
+        export_notes_ndjson(current_user.id, cursor, include_vectors),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": "attachment; filename=brainvault-notes.ndjson"}
+    )
+
+
+@app.post("/api/notes/import", status_code=status.HTTP_202_ACCEPTED)
+def import_notes(
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Start a bulk import of notes from an uploaded archive (protected endpoint).
+
+    Accepted files:
+        .ndjson / .jsonl - one {"title", "content", "tags"} object per line
+                           (a BrainVault NDJSON export works too)
+        .zip             - Markdown / text files; a leading "# Heading"
+                           becomes the note title, otherwise the file name
+
+    The import runs in the background; poll GET /api/notes/import/{job_id}.
+    Notes the user already has are skipped as duplicates.
+    """
+    fmt = import_format(file.filename)
+    if fmt is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Upload a .ndjson, .jsonl or .zip file"
+        )
+
+    try:
+        job = create_import_job(db, current_user.id, file.filename, fmt, file.file)
+    except ImportTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except zipfile.BadZipFile:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="The uploaded file is not a valid zip archive"
+        )
+
+    print(f"User {current_user.email} (ID: {current_user.id}) started import {job.id} ({job.total} records)")
+    start_import(job.id)
+    return import_status(job)
+
+
+def _get_import_job(db: Session, job_id: str, user: User) -> ImportJob:
+    job = db.get(ImportJob, job_id)
+    if job is None or job.user_id != user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Import job not found"
+        )
+    return job
+
+
+@app.get("/api/notes/import/{job_id}")
+def get_import(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Progress and throughput of an import job (protected endpoint)."""
+    return import_status(_get_import_job(db, job_id, current_user))
+
+
+@app.post("/api/notes/import/{job_id}/resume")
+def resume_import_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Resume an interrupted or failed import from its last checkpoint
+    (protected endpoint). Already imported records are not redone.
+    """
+    job = _get_import_job(db, job_id, current_user)
+    if not resume_import(db, job):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Import is {job.status} and cannot be resumed"
+        )
+    db.refresh(job)
+    return import_status(job)
+
+
+@app.get("/api/notes/{note_id}/related")
+def related_notes(
+    note_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Notes most similar to `note_id` (for the "related notes" panel).
+    Served from the precomputed neighbour graph - no vector search.
+    """
+    if not note_id.startswith(note_id_prefix(current_user.id)):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Note not found"
+        )
+    return {"note_id": note_id, "related": get_related(db, current_user.id, note_id)}
+
+
+# ============ ADMIN ENDPOINTS ============
+
+@app.get("/admin/profiles")
+def get_profiles(admin: User = Depends(get_admin_user)):
+    """List saved request profiles, newest first (admin only)."""
+    return {"profiles": list_profiles()}
+
+
+@app.get("/admin/profiles/{filename}")
+def download_profile(filename: str, admin: User = Depends(get_admin_user)):
+    """
+    Download one profile file (admin only):
+        *.speedscope.json - open in https://www.speedscope.app
+        *.collapsed.txt   - folded stacks for flamegraph.pl
+    """
+    path = profile_path(filename)
+    if path is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profile not found"
+        )
+    return FileResponse(path, filename=filename)
 
 
 # ============ OPTIONAL: GET endpoint to list user's notes ============
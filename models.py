@@ -1,5 +1,5 @@
 # models.py
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, BigInteger, Float, String, Text, JSON, DateTime, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.sql import func
 from database import Base
 
@@ -25,4 +25,186 @@ class User(Base):
 
     def __repr__(self):
         """String representation for debugging"""
-        return f"<User(id={self.id}, email={self.email})>"
\ No newline at end of file
+        return f"<User(id={self.id}, email={self.email})>"
+
+
+class NoteFingerprint(Base):
+    """
+    NoteFingerprint model - content fingerprints used to catch duplicate notes
+    before they are embedded (see dedupe_service.py)
+
+    Table structure:
+    - note_id: Pinecone vector id of the note
+    - content_hash: xxh64 of the normalized note text (exact duplicates)
+    - title_hash: xxh64 of the normalized title (autosave detection)
+    - simhash: 64-bit SimHash of the note's word shingles (near duplicates)
+    - band0..band3: the SimHash split into 4 x 16-bit bands, indexed so that
+      candidates within 3 differing bits can be found with an index lookup
+    """
+
+    __tablename__ = "note_fingerprints"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    note_id = Column(String, unique=True, nullable=False)
+    content_hash = Column(String, nullable=False)
+    title_hash = Column(String, nullable=True)
+    simhash = Column(BigInteger, nullable=False)
+    band0 = Column(Integer, nullable=False)
+    band1 = Column(Integer, nullable=False)
+    band2 = Column(Integer, nullable=False)
+    band3 = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index("ix_note_fingerprints_user_hash", "user_id", "content_hash"),
+        Index("ix_note_fingerprints_user_band0", "user_id", "band0"),
+        Index("ix_note_fingerprints_user_band1", "user_id", "band1"),
+        Index("ix_note_fingerprints_user_band2", "user_id", "band2"),
+        Index("ix_note_fingerprints_user_band3", "user_id", "band3"),
+    )
+
+    def __repr__(self):
+        return f"<NoteFingerprint(note_id={self.note_id}, user_id={self.user_id})>"
+
+
+class IdempotencyKey(Base):
+    """
+    IdempotencyKey model - remembers which note an `Idempotency-Key` header
+    produced, so client retries of POST /api/notes don't create new notes.
+    The row is inserted before the note is saved (note_id NULL while the
+    first request is still running), so concurrent retries can't both save it.
+
+    reserved_note_id is the id the note is written under, chosen with the
+    reservation: a retry after a failed or timed-out attempt (whose write
+    may still land) writes the same id again instead of a second copy.
+    """
+
+    __tablename__ = "idempotency_keys"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    key = Column(String, nullable=False)
+    note_id = Column(String, nullable=True)
+    reserved_note_id = Column(String, nullable=True)
+    released_at = Column(DateTime(timezone=True), nullable=True)  # set when an attempt failed
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "key", name="uq_idempotency_keys_user_key"),
+    )
+
+    def __repr__(self):
+        return f"<IdempotencyKey(user_id={self.user_id}, key={self.key})>"
+
+
+class Note(Base):
+    """
+    Note model - note bodies, when vectors only carry ids and filterable
+    fields (SLIM_VECTOR_METADATA, see note_store.py)
+
+    Table structure:
+    - id: Pinecone vector id of the note
+    - user_id: Owner of the note
+    - title / content: The note itself
+    """
+
+    __tablename__ = "notes"
+
+    id = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    title = Column(Text, nullable=False)
+    content = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<Note(id={self.id}, user_id={self.user_id})>"
+
+
+class RecentWrite(Base):
+    """
+    RecentWrite model - notes saved in the last RECENT_WRITE_TTL_S, searched
+    next to the index until Pinecone returns them (see recent_writes.py).
+    Kept in Postgres so every server.py worker sees every worker's writes.
+
+    Table structure:
+    - index_name: Index the note was written to ("" = primary)
+    - vector: The note's normalized embedding
+    - metadata: The note's full metadata (as search results carry it)
+    """
+
+    __tablename__ = "recent_writes"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    index_name = Column(String, nullable=False, default="")
+    note_id = Column(String, nullable=False)
+    vector = Column(JSON, nullable=False)
+    note_metadata = Column("metadata", JSON, nullable=False)  # "metadata" is reserved on models
+    written_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("index_name", "user_id", "note_id", name="uq_recent_writes_note"),
+        Index("ix_recent_writes_user_written", "user_id", "index_name", "written_at"),
+    )
+
+    def __repr__(self):
+        return f"<RecentWrite(note_id={self.note_id}, user_id={self.user_id})>"
+
+
+class NoteNeighbors(Base):
+    """
+    NoteNeighbors model - precomputed "related notes" of one note (its
+    nearest neighbours among the same user's notes, see related_notes.py)
+
+    Table structure:
+    - note_id: Pinecone vector id of the note
+    - neighbors: [{"id", "score", "title"}] best match first
+    """
+
+    __tablename__ = "note_neighbors"
+
+    note_id = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    neighbors = Column(JSON, nullable=False, default=list)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<NoteNeighbors(note_id={self.note_id}, user_id={self.user_id})>"
+
+
+class ImportJob(Base):
+    """
+    ImportJob model - one bulk import of an uploaded note archive
+    (see import_service.py)
+
+    Table structure:
+    - status: "queued" | "running" | "finished" | "failed"
+    - processed: records of the archive handled so far - the resume checkpoint
+    - imported / duplicates / failed: what happened to those records
+    - rate: records per second of the current run
+    """
+
+    __tablename__ = "import_jobs"
+
+    id = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    filename = Column(String, nullable=False)
+    format = Column(String, nullable=False)
+    path = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="queued")
+    total = Column(Integer)
+    processed = Column(Integer, nullable=False, default=0)
+    imported = Column(Integer, nullable=False, default=0)
+    duplicates = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    rate = Column(Float)
+    error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    finished_at = Column(DateTime(timezone=True))
+
+    def __repr__(self):
+        return f"<ImportJob(id={self.id}, user_id={self.user_id}, status={self.status})>"
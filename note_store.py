@@ -0,0 +1,132 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import List
+from sqlalchemy import any_, bindparam, String
+from sqlalchemy.dialects.postgresql import ARRAY
+from database import SessionLocal
+from models import Note
+from deadlines import apply_statement_timeout
+
+# SLIM_VECTOR_METADATA=true: vectors only carry the note id and small filterable
+# fields (user_id, created_at/created_ts, tags); title and content live in the
+# notes table and are joined back onto search results here.
+SLIM_VECTOR_METADATA = os.getenv("SLIM_VECTOR_METADATA", "false").lower() == "true"
+
+# Metadata fields that stay on the vector in slim mode
+SLIM_METADATA_FIELDS = ("user_id", "created_at", "created_ts", "tags")
+
+# Per-process LRU of hot note bodies: note_id -> (cached_at, (title, content)).
+# Other workers don't see this worker's cache, so an in-place update made by
+# one worker reaches the others' caches after at most NOTE_CACHE_TTL_S.
+NOTE_CACHE_SIZE = int(os.getenv("NOTE_CACHE_SIZE", "4096"))
+NOTE_CACHE_TTL_S = float(os.getenv("NOTE_CACHE_TTL_S", "30"))
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def slim_metadata(metadata: dict) -> dict:
+    """The part of a note's metadata that is stored on the vector in slim mode."""
+    return {k: v for k, v in metadata.items() if k in SLIM_METADATA_FIELDS}
+
+
+def _cache_put(note_id: str, body: tuple):
+    with _cache_lock:
+        _cache[note_id] = (time.monotonic(), body)
+        _cache.move_to_end(note_id)
+        while len(_cache) > NOTE_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def save_note_body(note_id: str, user_id: int, title: str, content: str):
+    """Insert or overwrite a note's body (written before its vector is upserted)."""
+    db = SessionLocal()
+    try:
+        db.merge(Note(id=note_id, user_id=user_id, title=title, content=content))
+        db.commit()
+    finally:
+        db.close()
+    _cache_put(note_id, (title, content))
+
+
+def save_note_bodies(notes: List[dict]):
+    """Bulk version of save_note_body: [{"id", "user_id", "title", "content"}] in one transaction."""
+    db = SessionLocal()
+    try:
+        for note in notes:
+            db.merge(Note(id=note["id"], user_id=note["user_id"], title=note["title"], content=note["content"]))
+        db.commit()
+    finally:
+        db.close()
+    # Don't flood the hot-note LRU with bulk imports; just drop stale copies
+    with _cache_lock:
+        for note in notes:
+            _cache.pop(note["id"], None)
+
+
+def load_note_bodies(note_ids: List[str]) -> dict:
+    """
+    Look up note bodies, from the LRU where possible (entries younger than
+    NOTE_CACHE_TTL_S) and with a single `WHERE id = ANY(...)` query for the rest.
+
+    Returns:
+        dict: note_id -> (title, content); unknown ids are left out
+    """
+    bodies = {}
+    missing = []
+    now = time.monotonic()
+    with _cache_lock:
+        for note_id in note_ids:
+            entry = _cache.get(note_id)
+            if entry is not None and now - entry[0] < NOTE_CACHE_TTL_S:
+                _cache.move_to_end(note_id)
+                bodies[note_id] = entry[1]
+            else:
+                missing.append(note_id)
+
+    if missing:
+        db = SessionLocal()
+        try:
+            apply_statement_timeout(db)
+            rows = (
+                db.query(Note.id, Note.title, Note.content)
+                .filter(Note.id == any_(bindparam("note_ids", missing, type_=ARRAY(String))))
+                .all()
+            )
+        finally:
+            db.close()
+        for note_id, title, content in rows:
+            bodies[note_id] = (title, content)
+            _cache_put(note_id, (title, content))
+
+    return bodies
+
+
+def hydrate(records: list) -> list:
+    """
+    Fill title / content / text into the metadata of vector records that
+    don't carry them (slim vectors). Records that still have their bodies in
+    metadata (saved before slim mode was turned on) are left as they are.
+
+    Args:
+        records: [{"id", "metadata", ...}] from vector_access query/fetch
+
+    Returns:
+        list: The same records, metadata completed in place
+    """
+    slim_ids = [r["id"] for r in records if "content" not in r["metadata"]]
+    if not slim_ids:
+        return records
+
+    bodies = load_note_bodies(slim_ids)
+    for record in records:
+        if record["id"] in bodies:
+            title, content = bodies[record["id"]]
+            record["metadata"] = {
+                **record["metadata"],
+                "title": title,
+                "content": content,
+                "text": f"{title}. {content}"
+            }
+    return records
@@ -1,10 +1,10 @@
 import os
-from pinecone.grpc import PineconeGRPC as Pinecone
 from dotenv import load_dotenv
 from langchain_pinecone import PineconeVectorStore
 from langchain_huggingface import HuggingFaceEndpointEmbeddings
 from langchain_core.documents import Document
 import requests
+from vector_access import get_index
 
 load_dotenv()
 
@@ -14,12 +14,8 @@ EMBEDDING_MODEL_URL = "https://router.huggingface.co/hf-inference/models/BAAI/bg
 
 
 
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-# Step 2: Connect to your specific index using the host URL
-index = pc.Index(
-    name=os.getenv("PINECONE_INDEX_NAME"),
-    host=os.getenv("PINECONE_HOST")
-)
+# Step 2: Connect to your specific index (shared gRPC channel, see vector_access.py)
+index = get_index(transport="grpc")
 
 # langchain wrapper functions
 vectorstore = PineconeVectorStore(
@@ -0,0 +1,219 @@
+import os
+import sys
+import json
+import time
+import random
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Optional
+
+# Admins may force a profile with the X-Profile header / ?profile=1;
+# PROFILE_SAMPLE_RATE profiles that fraction of all requests
+ADMIN_EMAILS = {e.strip().lower() for e in os.getenv("ADMIN_EMAILS", "").split(",") if e.strip()}
+PROFILE_HEADER = "X-Profile"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Retention: older profiles are deleted on every save (0 = no limit)
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))        # profiles kept (each is a file pair)
+PROFILE_MAX_AGE_DAYS = float(os.getenv("PROFILE_MAX_AGE_DAYS", "7"))
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# Frames from these files never make a thread "interesting" on their own
+# (the launcher is at the bottom of every worker's main thread)
+_IGNORED_APP_FILES = {os.path.join(APP_DIR, "server.py"), os.path.abspath(__file__)}
+
+# One profile per process at a time (samples cover every busy thread)
+_active = threading.Lock()
+
+
+def is_admin(email: Optional[str]) -> bool:
+    return bool(email) and email.lower() in ADMIN_EMAILS
+
+
+def should_sample() -> bool:
+    """Pick this request for sampled profiling?"""
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _is_interesting(filename: str) -> bool:
+    return (filename.startswith(APP_DIR) and filename not in _IGNORED_APP_FILES) or "langchain" in filename
+
+
+class SamplingProfiler:
+    """
+    Low-overhead sampling profiler: a background thread snapshots every
+    thread's Python stack (sys._current_frames) every PROFILE_INTERVAL_MS.
+
+    Only threads that are running app or LangChain code are recorded, so
+    idle pool workers and the idle event loop don't drown the profile.
+    Waiting on an upstream call shows up as time in the waiting frame.
+    Sampling covers the whole process, so requests running concurrently
+    on the same worker appear in the profile too.
+    """
+
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.stacks = Counter()     # (thread name, frame, frame, ...) root first -> samples
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self.started = None
+        self.elapsed = 0.0
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                interesting = False
+                while frame is not None:
+                    code = frame.f_code
+                    interesting = interesting or _is_interesting(code.co_filename)
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if interesting:
+                    stack.append(names.get(thread_id, str(thread_id)))
+                    self.stacks[tuple(reversed(stack))] += 1
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.elapsed = time.perf_counter() - self.started
+
+    def collapsed(self) -> str:
+        """Folded stacks ("a;b;c count" per line) for flamegraph.pl / speedscope."""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def speedscope(self, name: str) -> dict:
+        """Profile in speedscope's JSON format (https://www.speedscope.app)."""
+        frames = []
+        frame_index = {}
+        samples = []
+        weights = []
+        for stack, count in self.stacks.items():
+            indices = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    frames.append({"name": frame})
+                indices.append(frame_index[frame])
+            samples.append(indices)
+            weights.append(count * self.interval * 1000)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights
+            }],
+            "name": name,
+            "exporter": "brainvault-profiling"
+        }
+
+    def save(self, label: str) -> str:
+        """
+        Write <name>.collapsed.txt and <name>.speedscope.json to PROFILE_DIR
+        (then apply the retention limits); returns <name>.
+        """
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        slug = "".join(c if c.isalnum() else "-" for c in label).strip("-")[:60]
+        name = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{slug}-{int(self.elapsed * 1000)}ms"
+        with open(os.path.join(PROFILE_DIR, f"{name}.collapsed.txt"), "w") as f:
+            f.write(self.collapsed())
+        with open(os.path.join(PROFILE_DIR, f"{name}.speedscope.json"), "w") as f:
+            json.dump(self.speedscope(label), f)
+        prune_profiles()
+        return name
+
+
+def start_profile() -> Optional[SamplingProfiler]:
+    """Start sampling, unless another profile is already running in this process (then None)."""
+    if not _active.acquire(blocking=False):
+        return None
+    profiler = SamplingProfiler()
+    profiler.start()
+    return profiler
+
+
+def finish_profile(profiler: SamplingProfiler, label: str) -> Optional[str]:
+    """Stop sampling and save the profile; returns its name (None if it couldn't be saved)."""
+    profiler.stop()
+    _active.release()
+    try:
+        name = profiler.save(label)
+    except OSError as e:
+        print(f"⚠️ Could not save profile for {label}: {e}")
+        return None
+    print(f"🔬 Profile saved: {name} ({sum(profiler.stacks.values())} samples)")
+    return name
+
+
+@contextmanager
+def profile_block(label: str, enabled: bool = True):
+    """
+    Profile the code inside the block (for code that runs outside a request,
+    e.g. the LangChain pipeline called from a script). Skipped if another
+    profile - such as the surrounding request's - is already running.
+    """
+    profiler = start_profile() if enabled else None
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            finish_profile(profiler, label)
+
+
+def list_profiles() -> list:
+    """Saved profiles, newest first: [{"name", "files", "created_at"}]."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = {}
+    for filename in os.listdir(PROFILE_DIR):
+        for suffix in (".collapsed.txt", ".speedscope.json"):
+            if filename.endswith(suffix):
+                name = filename[:-len(suffix)]
+                entry = profiles.setdefault(name, {"name": name, "files": [], "created_at": None})
+                entry["files"].append(filename)
+                entry["created_at"] = datetime.fromtimestamp(
+                    os.path.getmtime(os.path.join(PROFILE_DIR, filename))
+                ).isoformat()
+    return sorted(profiles.values(), key=lambda p: p["created_at"], reverse=True)
+
+
+def prune_profiles():
+    """Delete the profiles beyond PROFILE_MAX_FILES (oldest first) or older than PROFILE_MAX_AGE_DAYS."""
+    cutoff = (datetime.now() - timedelta(days=PROFILE_MAX_AGE_DAYS)).isoformat() if PROFILE_MAX_AGE_DAYS > 0 else None
+    for position, profile in enumerate(list_profiles()):
+        too_many = PROFILE_MAX_FILES > 0 and position >= PROFILE_MAX_FILES
+        too_old = cutoff is not None and profile["created_at"] < cutoff
+        if not (too_many or too_old):
+            continue
+        for filename in profile["files"]:
+            try:
+                os.remove(os.path.join(PROFILE_DIR, filename))
+            except FileNotFoundError:
+                pass  # another worker pruned it first
+            except OSError as e:
+                print(f"⚠️ Could not delete old profile {filename}: {e}")
+
+
+def profile_path(filename: str) -> Optional[str]:
+    """Path of a saved profile file, or None if there is no such file (no path traversal)."""
+    if os.path.basename(filename) != filename or not filename.endswith((".collapsed.txt", ".speedscope.json")):
+        return None
+    path = os.path.join(PROFILE_DIR, filename)
+    return path if os.path.isfile(path) else None
@@ -0,0 +1,124 @@
+# rebuild_related.py
+"""
+Rebuild the related-notes graph (note_neighbors table) from scratch.
+
+store_note keeps the graph up to date incrementally; run this once to
+build it for notes saved before it existed, or to repair drift:
+
+    python rebuild_related.py                 # every user
+    python rebuild_related.py --user-id 42    # one (large) account
+
+Notes are listed by their '<user_id>-' id prefix; run backfill_metadata.py
+first so notes saved before ids were prefixed are included.
+
+All of a user's vectors are loaded once and compared block by block with
+a single matrix product, instead of one vector query per note.
+"""
+import argparse
+import time
+import numpy as np
+from database import SessionLocal
+from models import User, NoteNeighbors
+from export_service import iter_vector_pages
+from langchain_pinecone_service import note_id_prefix
+from note_store import hydrate
+from related_notes import RELATED_NOTES_K
+
+# Rows of the similarity matrix computed at once (block_size x num_notes floats)
+BLOCK_SIZE = 1024
+
+
+def load_user_vectors(user_id: int):
+    """All of a user's notes as (ids, titles, normalized float32 matrix)."""
+    ids, titles, vectors = [], [], []
+    for records, _ in iter_vector_pages(note_id_prefix(user_id)):
+        hydrate(records)  # titles of slim vectors
+        for record in records:
+            if record["metadata"].get("user_id") != user_id:
+                continue
+            ids.append(record["id"])
+            titles.append(record["metadata"].get("title", ""))
+            vectors.append(record["values"])
+
+    if not vectors:
+        return ids, titles, np.zeros((0, 0), dtype=np.float32)
+
+    matrix = np.asarray(vectors, dtype=np.float32)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    return ids, titles, matrix
+
+
+def nearest_neighbors(matrix: np.ndarray, k: int):
+    """
+    Top-k cosine neighbours of every row (itself excluded).
+
+    Returns:
+        tuple: (indices, scores), both shaped (num_notes, k), best first
+    """
+    n = matrix.shape[0]
+    k = min(k, n - 1)
+    indices = np.zeros((n, k), dtype=np.int64)
+    scores = np.zeros((n, k), dtype=np.float32)
+    if k <= 0:
+        return indices, scores
+
+    for start in range(0, n, BLOCK_SIZE):
+        block = matrix[start:start + BLOCK_SIZE] @ matrix.T
+        rows = np.arange(block.shape[0])
+        block[rows, start + rows] = -np.inf  # a note is not its own neighbour
+
+        top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        indices[start:start + len(rows)] = np.take_along_axis(top, order, axis=1)
+        scores[start:start + len(rows)] = np.take_along_axis(top_scores, order, axis=1)
+
+    return indices, scores
+
+
+def rebuild_user(user_id: int, k: int = RELATED_NOTES_K) -> int:
+    """Recompute and replace one user's whole graph. Returns the number of notes."""
+    ids, titles, matrix = load_user_vectors(user_id)
+    indices, scores = nearest_neighbors(matrix, k)
+
+    rows = [
+        {
+            "note_id": ids[i],
+            "user_id": user_id,
+            "neighbors": [
+                {"id": ids[j], "score": float(score), "title": titles[j]}
+                for j, score in zip(indices[i], scores[i])
+            ]
+        }
+        for i in range(len(ids))
+    ]
+
+    # Replace the user's graph in one transaction
+    db = SessionLocal()
+    try:
+        db.query(NoteNeighbors).filter(NoteNeighbors.user_id == user_id).delete()
+        db.bulk_insert_mappings(NoteNeighbors, rows)
+        db.commit()
+    finally:
+        db.close()
+    return len(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the related-notes graph")
+    parser.add_argument("--user-id", type=int, action="append", help="Only rebuild these users (repeatable)")
+    parser.add_argument("--k", type=int, default=RELATED_NOTES_K, help="Neighbours per note")
+    args = parser.parse_args()
+
+    user_ids = args.user_id
+    if not user_ids:
+        db = SessionLocal()
+        try:
+            user_ids = [user_id for (user_id,) in db.query(User.id).order_by(User.id)]
+        finally:
+            db.close()
+
+    for user_id in user_ids:
+        started = time.monotonic()
+        count = rebuild_user(user_id, args.k)
+        print(f"✅ User {user_id}: {count} notes linked in {time.monotonic() - started:.1f}s")
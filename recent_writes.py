@@ -0,0 +1,135 @@
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+import numpy as np
+from database import SessionLocal
+from models import RecentWrite
+from deadlines import apply_statement_timeout
+
+# Pinecone is eventually consistent: a note upserted a moment ago may not be
+# returned by the next query yet. Recently written vectors are kept here and
+# searched next to the index until it returns them (or they expire).
+#
+# They live in Postgres (recent_writes table), not in worker memory: under
+# server.py the follow-up request can be accepted by any worker - clients and
+# load balancers open new connections all the time.
+RECENT_WRITE_TTL_S = float(os.getenv("RECENT_WRITE_TTL_S", "60"))
+RECENT_WRITES_PER_USER = int(os.getenv("RECENT_WRITES_PER_USER", "200"))
+
+
+def _cutoff() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(seconds=RECENT_WRITE_TTL_S)
+
+
+def remember(user_id: int, note_id: str, vector: list, metadata: dict, index_name: Optional[str] = None):
+    """
+    Keep a just-written note searchable until the index catches up.
+    Never raises - the note itself is already saved.
+    """
+    vector = np.asarray(vector, dtype=np.float32)
+    vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    db = SessionLocal()
+    try:
+        # Replace an earlier version of the note, and drop this user's expired entries
+        db.query(RecentWrite).filter(
+            RecentWrite.user_id == user_id,
+            RecentWrite.index_name == (index_name or ""),
+            (RecentWrite.note_id == note_id) | (RecentWrite.written_at < _cutoff())
+        ).delete(synchronize_session=False)
+        db.add(RecentWrite(
+            user_id=user_id,
+            index_name=index_name or "",
+            note_id=note_id,
+            vector=vector.tolist(),
+            note_metadata=metadata,
+            written_at=datetime.now(timezone.utc)
+        ))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ Could not remember recent write '{note_id}': {e}")
+    finally:
+        db.close()
+
+
+def _matches_filter(metadata: dict, filter_dict: dict) -> bool:
+    """Evaluate the subset of Pinecone's filter language build_note_filter produces."""
+    for field, conditions in filter_dict.items():
+        value = metadata.get(field)
+        for op, expected in conditions.items():
+            if op == "$eq" and value != expected:
+                return False
+            if op == "$gte" and (value is None or value < expected):
+                return False
+            if op == "$lte" and (value is None or value > expected):
+                return False
+            if op == "$in":
+                values = value if isinstance(value, list) else [value]
+                if not set(values) & set(expected):
+                    return False
+    return True
+
+
+def merge(user_id: int, query_vector: list, results: list, top_k: int, filter_dict: dict, index_name: Optional[str] = None) -> list:
+    """
+    Merge recently written notes into the index's results.
+
+    Recent notes are loaded with one indexed query and scored with one
+    matrix-vector product (cosine, like the index). A note the index already
+    returns in its current version is considered visible and dropped;
+    otherwise the recent copy wins over a stale index copy with the same id.
+
+    Args:
+        user_id: Owner of the notes being searched
+        query_vector: Embedding of the search query
+        results: Index matches [{"id", "score", "metadata", ...}]
+        top_k: Number of results to return
+        filter_dict: The Pinecone filter the index query used
+        index_name: Index the results came from (None = primary)
+
+    Returns:
+        list: Merged matches, best first, at most top_k
+    """
+    db = SessionLocal()
+    try:
+        apply_statement_timeout(db)
+        rows = (
+            db.query(RecentWrite.id, RecentWrite.note_id, RecentWrite.vector, RecentWrite.note_metadata)
+            .filter(
+                RecentWrite.user_id == user_id,
+                RecentWrite.index_name == (index_name or ""),
+                RecentWrite.written_at >= _cutoff()
+            )
+            .order_by(RecentWrite.written_at.desc())
+            .limit(RECENT_WRITES_PER_USER)
+            .all()
+        )
+        if not rows:
+            return results
+
+        # Forget the notes the index now returns in the same version
+        returned = {match["id"]: match["metadata"] for match in results}
+        visible = [
+            row.id for row in rows
+            if row.note_id in returned and returned[row.note_id].get("created_at") == row.note_metadata.get("created_at")
+        ]
+        if visible:
+            db.query(RecentWrite).filter(RecentWrite.id.in_(visible)).delete(synchronize_session=False)
+            db.commit()
+    finally:
+        db.close()
+
+    candidates = [row for row in rows if row.id not in visible and _matches_filter(row.note_metadata, filter_dict)]
+    if not candidates:
+        return results
+
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+    scores = np.asarray([row.vector for row in candidates], dtype=np.float32) @ query
+
+    merged = {match["id"]: match for match in results}
+    for row, score in zip(candidates, scores):
+        merged[row.note_id] = {"id": row.note_id, "score": float(score), "metadata": row.note_metadata, "values": None}
+
+    return sorted(merged.values(), key=lambda match: match["score"], reverse=True)[:top_k]
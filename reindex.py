@@ -0,0 +1,131 @@
+# reindex.py
+"""
+Online re-index: copy every note from the primary index into
+REINDEX_TARGET_INDEX, re-embedding it with REINDEX_TARGET_MODEL.
+
+Typical migration:
+    1. Set REINDEX_TARGET_INDEX / REINDEX_TARGET_MODEL and REINDEX_DUAL_WRITE=true
+       on the API so new saves reach both indexes.
+    2. Run `python reindex.py` (safe to stop and re-run - it resumes
+       from its checkpoint file).
+    3. Set VECTOR_READ_PATH=shadow and watch the shadow read report.
+    4. Set VECTOR_READ_PATH=target (or point PINECONE_INDEX_NAME /
+       EMBEDDING_MODEL at the new index and model).
+"""
+import os
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import vector_access
+from langchain_pinecone_service import (
+    target_embedding_model,
+    REINDEX_TARGET_INDEX,
+    REINDEX_TARGET_MODEL,
+)
+from export_service import iter_vector_pages
+from note_store import hydrate
+
+CHECKPOINT_FILE = os.getenv("REINDEX_CHECKPOINT_FILE", "reindex_checkpoint.json")
+
+
+class RateLimiter:
+    """Allow at most `rate` calls per second across all worker threads."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def load_checkpoint(path: str) -> dict:
+    """Read the last saved checkpoint (empty dict if none)."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(path: str, checkpoint: dict):
+    """Write the checkpoint atomically so a crash never leaves it half-written."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def reembed_batch(records: list, limiter: RateLimiter) -> int:
+    """Embed one batch with the target model and upsert it into the target index."""
+    # Slim vectors have no text in metadata - embed the body from Postgres,
+    # but copy the (slim) metadata over unchanged
+    hydrated = hydrate([{"id": r["id"], "metadata": r["metadata"]} for r in records])
+    texts = [
+        r["metadata"].get("text") or f"{r['metadata'].get('title', '')}. {r['metadata'].get('content', '')}"
+        for r in hydrated
+    ]
+
+    limiter.wait()
+    embeddings = target_embedding_model.embed_documents(texts)
+
+    return vector_access.upsert(
+        [{"id": r["id"], "values": values, "metadata": r["metadata"]} for r, values in zip(records, embeddings)],
+        index_name=REINDEX_TARGET_INDEX
+    )
+
+
+def run_reindex(batch_size: int, workers: int, max_rps: float, checkpoint_path: str, restart: bool = False):
+    """
+    Stream all notes from the primary index, re-embed them in parallel
+    batches and write them to the target index.
+
+    The checkpoint (list cursor + counters) is saved after every fully
+    written page, so an interrupted run redoes at most one page.
+    """
+    if target_embedding_model is None:
+        raise SystemExit("REINDEX_TARGET_INDEX is not set - nothing to re-index into")
+
+    checkpoint = {} if restart else load_checkpoint(checkpoint_path)
+    if checkpoint.get("finished"):
+        print(f"✅ Re-index into {REINDEX_TARGET_INDEX} already finished ({checkpoint['done']} notes)")
+        return
+
+    done = checkpoint.get("done", 0)
+    limiter = RateLimiter(max_rps)
+    started = time.monotonic()
+    print(f"🔁 Re-indexing into {REINDEX_TARGET_INDEX} with {REINDEX_TARGET_MODEL} "
+          f"(resuming after {done} notes)" if done else
+          f"🔁 Re-indexing into {REINDEX_TARGET_INDEX} with {REINDEX_TARGET_MODEL}")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for records, next_cursor in iter_vector_pages(cursor=checkpoint.get("cursor")):
+            batches = [records[i:i + batch_size] for i in range(0, len(records), batch_size)]
+            done += sum(pool.map(lambda batch: reembed_batch(batch, limiter), batches))
+
+            save_checkpoint(checkpoint_path, {"cursor": next_cursor, "done": done, "finished": next_cursor is None})
+            rate = done / max(time.monotonic() - started, 1e-6)
+            print(f"   {done} notes re-indexed ({rate:.1f}/s)")
+
+    print(f"✅ Re-index into {REINDEX_TARGET_INDEX} finished: {done} notes")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-embed all notes into REINDEX_TARGET_INDEX")
+    parser.add_argument("--batch-size", type=int, default=32, help="Notes per embedding call")
+    parser.add_argument("--workers", type=int, default=4, help="Parallel embedding calls")
+    parser.add_argument("--max-rps", type=float, default=5.0, help="Max embedding calls per second (0 = unlimited)")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE, help="Checkpoint file path")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start over")
+    args = parser.parse_args()
+
+    run_reindex(args.batch_size, args.workers, args.max_rps, args.checkpoint, args.restart)
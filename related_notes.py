@@ -0,0 +1,182 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from sqlalchemy import String, cast
+from sqlalchemy.orm import Session
+import vector_access
+import recent_writes
+from database import SessionLocal
+from models import NoteNeighbors
+from note_store import hydrate
+
+# Neighbours kept per note for the "related notes" panel
+RELATED_NOTES_K = int(os.getenv("RELATED_NOTES_K", "10"))
+
+# Graph updates run off the request path - a save never waits for them
+_update_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="related")
+
+
+def _neighbor_query(user_id: int, note_id: str, vector: list) -> list:
+    """A note's RELATED_NOTES_K nearest neighbours among the user's other notes, best first."""
+    filter_dict = {"user_id": {"$eq": user_id}}
+    results = vector_access.query(vector, RELATED_NOTES_K + 1, filter=filter_dict)
+    # Notes saved moments ago aren't in the index yet - don't miss them as neighbours
+    results = hydrate(recent_writes.merge(user_id, vector, results, RELATED_NOTES_K + 1, filter_dict))
+    return [
+        {"id": r["id"], "score": r["score"], "title": r["metadata"].get("title", "")}
+        for r in results if r["id"] != note_id
+    ][:RELATED_NOTES_K]
+
+
+def _cosine(a: list, b: list) -> float:
+    a, b = np.asarray(a, dtype=np.float32), np.asarray(b, dtype=np.float32)
+    return float(a @ b / max(float(np.linalg.norm(a) * np.linalg.norm(b)), 1e-12))
+
+
+def _update_reverse_edge(neighbors: list, edge: dict) -> tuple:
+    """
+    Patch one other note's neighbour list after `edge["id"]` changed.
+
+    The list is taken to be that note's top-K, so a note not on it scores
+    at most its current K-th score. If the edited note still reaches that
+    score, it is (re-)scored in place. Otherwise it drops out - and if it
+    was on the list, another note may now belong in the freed slot, so the
+    list needs a refill query.
+
+    Returns:
+        tuple: (new neighbour list, needs_refill)
+    """
+    others = [n for n in neighbors if n["id"] != edge["id"]]
+    was_listed = len(others) < len(neighbors)
+    kth_score = min(n["score"] for n in neighbors) if len(neighbors) >= RELATED_NOTES_K else None
+
+    if kth_score is None or edge["score"] >= kth_score:
+        kept = others + [edge]
+        kept.sort(key=lambda n: n["score"], reverse=True)
+        return kept[:RELATED_NOTES_K], False
+    return others, was_listed
+
+
+def update_neighbors(user_id: int, note_id: str, vector: list, title: str):
+    """
+    Incrementally update the kNN graph after a note was inserted or edited.
+
+    One vector query finds the note's own neighbours. Then the reverse edges
+    are patched with the note's new similarities, for every note that lists
+    it (found through the in-edge lookup below) and every note that is or
+    was its own neighbour. kNN isn't symmetric, so such a note keeps this
+    one only if it still makes that note's own top-K; a list that loses it
+    is refilled with one query of its own. Rows are locked so concurrent
+    saves in other workers don't overwrite each other's edges.
+
+    This stays an approximation: a note that neither lists this one nor is
+    among its neighbours isn't checked, even if this note now belongs in
+    its top-K (rebuild_related.py recomputes the whole graph).
+
+    Args:
+        user_id: Owner of the note
+        note_id: Vector id of the note that was saved
+        vector: The note's embedding (already computed by store_note)
+        title: The note's title (shown in the panel)
+    """
+    neighbors = _neighbor_query(user_id, note_id, vector)
+    new_scores = {n["id"]: n["score"] for n in neighbors}
+
+    db = SessionLocal()
+    refill = []
+    try:
+        own = db.get(NoteNeighbors, note_id)
+        previous_ids = {n["id"] for n in own.neighbors} if own else set()
+
+        # In-edges: the notes listing this one (neighbour lists are JSON, so
+        # narrow down with a text match, then check the ids exactly)
+        listing = db.query(NoteNeighbors.note_id, NoteNeighbors.neighbors).filter(
+            NoteNeighbors.user_id == user_id,
+            NoteNeighbors.note_id != note_id,
+            cast(NoteNeighbors.neighbors, String).contains(f'"{note_id}"', autoescape=True)
+        )
+        in_edges = {row.note_id for row in listing if any(n["id"] == note_id for n in row.neighbors)}
+
+        # Notes that aren't among its neighbours now: their similarity to it
+        # comes from their stored vectors (one not indexed yet keeps its
+        # edge until its own save updates the graph)
+        rescore = sorted((previous_ids | in_edges) - set(new_scores))
+        stored = vector_access.fetch(rescore) if rescore else {}
+        for other_id, record in stored.items():
+            new_scores[other_id] = _cosine(vector, record["values"])
+
+        # Lock every row we touch, in a fixed order so two saves can't deadlock
+        touched = sorted(set(new_scores) | {note_id})
+        rows = (
+            db.query(NoteNeighbors)
+            .filter(NoteNeighbors.note_id.in_(touched), NoteNeighbors.user_id == user_id)
+            .order_by(NoteNeighbors.note_id)
+            .with_for_update()
+            .all()
+        )
+        rows = {row.note_id: row for row in rows}
+
+        own = rows.pop(note_id, None)
+        if own is None:
+            own = NoteNeighbors(note_id=note_id, user_id=user_id)
+            db.add(own)
+        own.neighbors = neighbors
+
+        for row in rows.values():
+            row.neighbors, needs_refill = _update_reverse_edge(
+                row.neighbors, {"id": note_id, "score": new_scores[row.note_id], "title": title}
+            )
+            if needs_refill:
+                refill.append(row.note_id)
+
+        db.commit()
+    finally:
+        db.close()
+
+    for other_id in refill:
+        refill_neighbors(user_id, other_id)
+
+
+def refill_neighbors(user_id: int, note_id: str):
+    """Recompute one note's own neighbour list from a vector query (its reverse edges are left alone)."""
+    record = vector_access.fetch([note_id]).get(note_id)
+    if record is None:
+        return  # deleted meanwhile
+    neighbors = _neighbor_query(user_id, note_id, record["values"])
+
+    db = SessionLocal()
+    try:
+        row = (
+            db.query(NoteNeighbors)
+            .filter(NoteNeighbors.note_id == note_id, NoteNeighbors.user_id == user_id)
+            .with_for_update()
+            .first()
+        )
+        if row is not None:
+            row.neighbors = neighbors
+            db.commit()
+    finally:
+        db.close()
+
+
+def schedule_update(user_id: int, note_id: str, vector: list, title: str):
+    """Run update_neighbors in the background (errors are logged, never raised)."""
+    def log_failure(future):
+        if future.exception() is not None:
+            print(f"⚠️ Related-notes update for '{note_id}' failed: {future.exception()}")
+
+    _update_pool.submit(update_neighbors, user_id, note_id, vector, title).add_done_callback(log_failure)
+
+
+def get_related(db: Session, user_id: int, note_id: str) -> list:
+    """
+    The precomputed related notes of one note - a single primary-key lookup.
+
+    Returns:
+        list: [{"id", "score", "title"}] best match first - empty until the
+              graph has been built for this note (see rebuild_related.py)
+    """
+    row = db.get(NoteNeighbors, note_id)
+    if row is None or row.user_id != user_id:
+        return []
+    return row.neighbors
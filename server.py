@@ -0,0 +1,353 @@
+# server.py
+"""
+Multi-process launcher for the BrainVault API.
+
+    python server.py
+
+The master process binds the listening socket, preloads heavy read-only
+state (tokenizers, local model weights) and then forks the workers, so
+those pages are shared copy-on-write instead of being loaded once per
+worker. Network clients (Pinecone, Hugging Face, PostgreSQL) are created
+inside each worker after the fork, when `main` is imported.
+
+Environment:
+    APP_MODULE         ASGI app to serve (default main:app)
+    WEB_WORKERS        number of workers (default: CPUs available to the container)
+    HOST / PORT        bind address (default 0.0.0.0:8000)
+    WORKER_TIMEOUT     seconds without a heartbeat before a worker is killed
+    WORKER_STATE_DIR   where workers publish their health (read by /health/workers)
+
+Signals (sent to the master):
+    SIGHUP             rolling restart - one worker at a time, no downtime
+    SIGTERM / SIGINT   graceful shutdown
+"""
+import os
+import gc
+import sys
+import json
+import time
+import signal
+import socket
+import asyncio
+
+APP_MODULE = os.getenv("APP_MODULE", "main:app")
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+WORKER_TIMEOUT = int(os.getenv("WORKER_TIMEOUT", "60"))
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+WORKER_STATE_DIR = os.getenv("WORKER_STATE_DIR", "/tmp/brainvault-workers")
+HEARTBEAT_INTERVAL = 2
+
+
+def available_cpus() -> int:
+    """
+    CPUs this process may actually use: CPU affinity, further limited by
+    a cgroup v2 CPU quota (e.g. `docker run --cpus=2`).
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "0")) or available_cpus()
+
+
+def preload():
+    """
+    Load heavy, fork-safe, read-only state in the master before forking.
+    Anything that opens network connections or threads must NOT go here.
+    """
+    print("📦 Preloading shared libraries and models...")
+    import numpy  # noqa: F401
+    import tokenizers  # noqa: F401
+
+    if os.getenv("QA_BACKEND", "remote") == "local":
+        import local_qa_service
+        local_qa_service.load_model()
+
+    # Move everything loaded so far out of the GC's reach, so collections
+    # in the workers don't touch (and un-share) these pages
+    gc.collect()
+    gc.freeze()
+
+
+# ============ WORKER HEALTH ============
+
+def _state_path(pid: int) -> str:
+    return os.path.join(WORKER_STATE_DIR, f"worker-{pid}.json")
+
+
+def write_worker_state(state: dict):
+    """Publish this worker's health (atomic replace so readers never see half a file)."""
+    path = _state_path(os.getpid())
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def remove_worker_state(pid: int):
+    try:
+        os.remove(_state_path(pid))
+    except FileNotFoundError:
+        pass
+
+
+def read_worker_states() -> list:
+    """
+    Health of every worker, as published by the workers themselves.
+    A worker whose heartbeat is older than WORKER_TIMEOUT is reported as unhealthy.
+    """
+    if not os.path.isdir(WORKER_STATE_DIR):
+        return []
+
+    now = time.time()
+    states = []
+    for name in sorted(os.listdir(WORKER_STATE_DIR)):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(WORKER_STATE_DIR, name)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            continue
+        state["healthy"] = state.get("ready", False) and now - state.get("heartbeat", 0) < WORKER_TIMEOUT
+        states.append(state)
+    return states
+
+
+async def _heartbeat(server, worker_index: int, started_at: float):
+    """
+    Runs on the worker's event loop, so a blocked loop stops the heartbeat
+    and the master notices.
+    """
+    while True:
+        write_worker_state({
+            "worker": worker_index,
+            "pid": os.getpid(),
+            "started_at": started_at,
+            "heartbeat": time.time(),
+            "ready": server.started,
+            "total_requests": server.server_state.total_requests,
+            "open_connections": len(server.server_state.connections),
+        })
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+# ============ WORKER PROCESS ============
+
+def run_worker(sock: socket.socket, worker_index: int):
+    """Body of a forked worker: serve the app on the shared socket until told to stop."""
+    import uvicorn
+
+    # The master's signal handlers must not leak into the worker
+    for sig in (signal.SIGHUP, signal.SIGCHLD, signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, signal.SIG_DFL)
+
+    # Workers already run in parallel; keep torch from oversubscribing the cores
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(max(1, available_cpus() // WEB_WORKERS))
+
+    config = uvicorn.Config(
+        APP_MODULE,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        proxy_headers=True,
+    )
+    server = uvicorn.Server(config)
+    started_at = time.time()
+
+    async def serve():
+        heartbeat = asyncio.create_task(_heartbeat(server, worker_index, started_at))
+        try:
+            await server.serve(sockets=[sock])
+        finally:
+            heartbeat.cancel()
+
+    asyncio.run(serve())
+
+
+# ============ MASTER PROCESS ============
+
+class Master:
+    """Keeps WEB_WORKERS workers alive on one shared listening socket."""
+
+    def __init__(self, num_workers: int):
+        self.num_workers = num_workers
+        self.workers = {}  # pid -> worker index
+        self.sock = None
+        self.shutting_down = False
+        self.reload_requested = False
+        self.replacing = ()  # (old pid, new pid) while a rolling restart swaps one worker
+
+    def bind(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((HOST, PORT))
+        self.sock.listen(2048)
+        self.sock.set_inheritable(True)
+
+    def spawn(self, worker_index: int) -> int:
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                run_worker(self.sock, worker_index)
+            except BaseException as e:
+                print(f"❌ Worker {worker_index} crashed: {e!r}")
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+
+        self.workers[pid] = worker_index
+        print(f"🚀 Worker {worker_index} started (pid {pid})")
+        return pid
+
+    def reap(self):
+        """Collect exited workers and replace them (unless we're shutting down)."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            remove_worker_state(pid)
+            worker_index = self.workers.pop(pid, None)
+            if worker_index is None:
+                continue  # a worker retired by a rolling restart
+            if self.shutting_down:
+                continue
+            print(f"⚠️ Worker {worker_index} (pid {pid}) exited with status {status}")
+            if pid in self.replacing:
+                continue  # rolling_restart() decides what takes this slot
+            self.spawn(worker_index)
+
+    def kill_hung_workers(self):
+        """SIGKILL workers whose event loop has stopped heartbeating."""
+        now = time.time()
+        for state in read_worker_states():
+            pid = state.get("pid")
+            if pid in self.workers and now - state.get("heartbeat", now) > WORKER_TIMEOUT:
+                print(f"⚠️ Worker {state['worker']} (pid {pid}) missed its heartbeat, killing it")
+                os.kill(pid, signal.SIGKILL)
+
+    def wait_until_ready(self, pid: int, timeout: float) -> bool:
+        """Wait for a freshly spawned worker to report that it is serving."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            for state in read_worker_states():
+                if state.get("pid") == pid and state.get("ready"):
+                    return True
+            if pid not in self.workers:
+                return False  # died during startup
+            time.sleep(0.2)
+            self.reap()
+        return False
+
+    def stop_worker(self, pid: int):
+        """Gracefully stop one worker and wait for it to finish in-flight requests."""
+        self.workers.pop(pid, None)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        deadline = time.time() + GRACEFUL_TIMEOUT + 5
+        try:
+            while time.time() < deadline:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+                if done:
+                    break
+                time.sleep(0.1)
+            else:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass  # already collected by reap()
+        remove_worker_state(pid)
+
+    def rolling_restart(self):
+        """
+        Replace the workers one at a time: start the replacement, wait until
+        it serves, then retire the old one. The socket never stops accepting.
+        """
+        print("🔄 Rolling restart of all workers...")
+        for old_pid, worker_index in list(self.workers.items()):
+            if old_pid not in self.workers:
+                continue  # died meanwhile - reap() already started a replacement on the new code
+
+            new_pid = self.spawn(worker_index)
+            self.replacing = (old_pid, new_pid)
+            try:
+                ready = self.wait_until_ready(new_pid, timeout=WORKER_TIMEOUT)
+            finally:
+                self.replacing = ()
+
+            if not ready:
+                print(f"❌ Replacement for worker {worker_index} did not become ready, aborting restart")
+                if new_pid in self.workers:
+                    self.stop_worker(new_pid)
+                if old_pid not in self.workers:
+                    self.spawn(worker_index)  # the old worker died too - keep the slot filled
+                return
+            self.stop_worker(old_pid)
+        print("✅ Rolling restart complete")
+
+    def shutdown(self):
+        print("🛑 Shutting down workers...")
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.time() + GRACEFUL_TIMEOUT + 5
+        while self.workers and time.time() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            os.kill(pid, signal.SIGKILL)
+
+    def run(self):
+        os.makedirs(WORKER_STATE_DIR, exist_ok=True)
+        for name in os.listdir(WORKER_STATE_DIR):
+            os.remove(os.path.join(WORKER_STATE_DIR, name))
+
+        self.bind()
+        preload()
+
+        def on_terminate(sig, frame):
+            self.shutting_down = True
+
+        def on_reload(sig, frame):
+            self.reload_requested = True
+
+        signal.signal(signal.SIGTERM, on_terminate)
+        signal.signal(signal.SIGINT, on_terminate)
+        signal.signal(signal.SIGHUP, on_reload)
+
+        print(f"🧠 BrainVault master (pid {os.getpid()}) on {HOST}:{PORT} with {self.num_workers} workers")
+        for worker_index in range(self.num_workers):
+            self.spawn(worker_index)
+
+        while not self.shutting_down:
+            self.reap()
+            if self.reload_requested:
+                self.reload_requested = False
+                self.rolling_restart()
+            self.kill_hung_workers()
+            time.sleep(0.5)
+
+        self.shutdown()
+
+
+if __name__ == "__main__":
+    Master(WEB_WORKERS).run()
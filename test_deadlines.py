@@ -0,0 +1,162 @@
+# test_deadlines.py
+import time
+import threading
+import pytest
+import requests
+import deadlines
+from deadlines import DeadlineExceeded, call_with_deadline, set_deadline, reset_deadline, remaining
+
+
+@pytest.fixture
+def deadline():
+    """Run the test inside a request budget of the given seconds."""
+    tokens = []
+
+    def start(seconds: float):
+        tokens.append(set_deadline(seconds))
+
+    yield start
+    for token in reversed(tokens):
+        reset_deadline(token)
+
+
+@pytest.fixture(autouse=True)
+def fresh_latencies():
+    deadlines._latencies.clear()
+    yield
+    deadlines._latencies.clear()
+
+
+def prime_latency(name: str, seconds: float, samples: int = deadlines.HEDGE_MIN_SAMPLES):
+    for _ in range(samples):
+        deadlines._record_latency(name, seconds)
+
+
+def test_returns_result_without_deadline():
+    assert remaining() is None
+    assert call_with_deadline("add", lambda a, b: a + b, 2, b=3) == 5
+
+
+def test_upstream_errors_propagate(deadline):
+    deadline(1.0)
+
+    def fail():
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        call_with_deadline("fail", fail)
+
+
+def test_deadline_expiry_abandons_the_call(deadline):
+    deadline(0.1)
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        call_with_deadline("slow", time.sleep, 2)
+    assert time.monotonic() - started < 0.5
+
+
+def test_no_budget_left_fails_fast(deadline):
+    deadline(0)
+    calls = []
+    with pytest.raises(DeadlineExceeded):
+        call_with_deadline("never", calls.append, 1)
+    assert calls == []
+
+
+def test_call_sees_the_remaining_budget(deadline):
+    deadline(1.0)
+    budget = call_with_deadline("budget", remaining)
+    assert 0 < budget <= 1.0
+
+
+@pytest.mark.parametrize("error", [TimeoutError("future timed out"), requests.exceptions.ReadTimeout("read timed out")])
+def test_inner_timeouts_count_as_deadline(deadline, error):
+    deadline(1.0)
+
+    def times_out():
+        raise error
+
+    with pytest.raises(DeadlineExceeded):
+        call_with_deadline("inner_timeout", times_out)
+
+
+def test_hedges_after_p95(deadline):
+    deadline(5.0)
+    prime_latency("hedged", 0.05)
+    attempts = []
+    lock = threading.Lock()
+
+    def first_slow_then_fast():
+        with lock:
+            attempts.append(time.monotonic())
+            attempt = len(attempts)
+        time.sleep(2.0 if attempt == 1 else 0.01)
+        return attempt
+
+    started = time.monotonic()
+    assert call_with_deadline("hedged", first_slow_then_fast, hedge=True) == 2
+    assert len(attempts) == 2
+    # The second attempt went out once the first passed the p95 (50 ms), not before
+    assert 0.04 <= attempts[1] - started < 0.5
+    assert time.monotonic() - started < 1.0
+
+
+def test_no_hedge_before_enough_samples(deadline):
+    deadline(5.0)
+    prime_latency("cold", 0.01, samples=deadlines.HEDGE_MIN_SAMPLES - 1)
+    attempts = []
+
+    def slow():
+        attempts.append(1)
+        time.sleep(0.2)
+        return "done"
+
+    assert call_with_deadline("cold", slow, hedge=True) == "done"
+    assert len(attempts) == 1
+
+
+def test_not_hedged_unless_asked(deadline):
+    deadline(5.0)
+    prime_latency("unhedged", 0.01)
+    attempts = []
+
+    def slow():
+        attempts.append(1)
+        time.sleep(0.2)
+        return "done"
+
+    assert call_with_deadline("unhedged", slow) == "done"
+    assert len(attempts) == 1
+
+
+def test_no_hedge_while_pool_is_busy(deadline, monkeypatch):
+    deadline(5.0)
+    prime_latency("busy", 0.01)
+    monkeypatch.setattr(deadlines, "HEDGE_MAX_IN_FLIGHT", 1)
+    attempts = []
+
+    def slow():
+        attempts.append(1)
+        time.sleep(0.2)
+        return "done"
+
+    assert call_with_deadline("busy", slow, hedge=True) == "done"
+    assert len(attempts) == 1
+
+
+def test_hedged_call_still_bounded_by_deadline(deadline):
+    deadline(0.3)
+    prime_latency("hedged_slow", 0.05)
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        call_with_deadline("hedged_slow", time.sleep, 2, hedge=True)
+    assert time.monotonic() - started < 0.8
+
+
+def test_streaming_export_has_no_deadline():
+    assert deadlines.deadline_for("/api/notes/export", "100") is None
+    token = set_deadline(None)
+    try:
+        assert remaining() is None
+    finally:
+        reset_deadline(token)
@@ -0,0 +1,207 @@
+# test_dedupe.py
+import os
+import time
+import random
+import threading
+import pytest
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from database import Base
+import dedupe_service
+from dedupe_service import (
+    NUM_BANDS,
+    Fingerprint,
+    IdempotencyConflict,
+    Reservation,
+    fingerprint,
+    find_duplicate,
+    record_fingerprint,
+    reserve_idempotency_key,
+    complete_idempotency_key,
+    release_idempotency_key,
+)
+
+
+def make_session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)()
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+# ============ fingerprint ============
+
+def test_fingerprint_ignores_case_punctuation_and_whitespace():
+    a = fingerprint("Team Sync", "Discussed the Q3 roadmap.   Next steps: hiring!")
+    b = fingerprint("team sync", "discussed the q3 roadmap next steps hiring")
+    assert a.content_hash == b.content_hash
+    assert a.simhash == b.simhash
+    assert a.title_hash == b.title_hash
+
+
+def test_fingerprint_small_edit_is_close_large_edit_is_far():
+    words = [f"word{i}" for i in range(200)]
+    base = fingerprint("Notes", " ".join(words))
+    edited = fingerprint("Notes", " ".join(words[:-1] + ["changed"]))
+    other = fingerprint("Notes", " ".join(f"other{i}" for i in range(200)))
+
+    assert base.content_hash != edited.content_hash
+    assert hamming(base.simhash, edited.simhash) <= 3
+    assert hamming(base.simhash, other.simhash) > 3
+
+
+def test_fingerprint_is_64_bits_and_handles_short_notes():
+    fp = fingerprint("Hi", "")
+    assert 0 <= fp.simhash < 1 << 64
+    assert len(fp.bands) == NUM_BANDS
+
+
+def test_distance_up_to_3_always_shares_a_band():
+    # Pigeonhole: 3 flipped bits can touch at most 3 of the 4 bands
+    rng = random.Random(0)
+    for _ in range(5000):
+        simhash = rng.getrandbits(64)
+        flipped = simhash
+        for bit in rng.sample(range(64), rng.randint(0, 3)):
+            flipped ^= 1 << bit
+        a = Fingerprint(content_hash="a", simhash=simhash, title_hash="t")
+        b = Fingerprint(content_hash="b", simhash=flipped, title_hash="t")
+        assert any(x == y for x, y in zip(a.bands, b.bands))
+
+
+# ============ find_duplicate ============
+
+def test_find_duplicate_exact():
+    db = make_session()
+    fp = fingerprint("Groceries", "milk, eggs, bread")
+    record_fingerprint(db, 1, "1-a", fp)
+
+    assert find_duplicate(db, 1, fingerprint("groceries", "Milk eggs bread.")) == ("exact", "1-a")
+    # Another user's notes never match
+    assert find_duplicate(db, 2, fp) == (None, None)
+
+
+def test_find_duplicate_near_within_distance(monkeypatch):
+    monkeypatch.setattr(dedupe_service, "NEAR_DUPLICATE_POLICY", "link")
+    db = make_session()
+    stored = Fingerprint(content_hash="h1", simhash=0x0123456789ABCDEF, title_hash="t")
+    record_fingerprint(db, 1, "1-a", stored)
+
+    near = Fingerprint(content_hash="h2", simhash=stored.simhash ^ 0b1011, title_hash="other")
+    far = Fingerprint(content_hash="h3", simhash=stored.simhash ^ 0b11110000, title_hash="t")
+    assert find_duplicate(db, 1, near) == ("near", "1-a")
+    assert find_duplicate(db, 1, far) == (None, None)
+
+
+def test_find_duplicate_handles_high_bit_hashes(monkeypatch):
+    # simhashes >= 2**63 are stored as negative BIGINTs
+    monkeypatch.setattr(dedupe_service, "NEAR_DUPLICATE_POLICY", "link")
+    db = make_session()
+    stored = Fingerprint(content_hash="h1", simhash=(1 << 64) - 1, title_hash="t")
+    record_fingerprint(db, 1, "1-a", stored)
+
+    near = Fingerprint(content_hash="h2", simhash=stored.simhash ^ 1, title_hash="t")
+    assert find_duplicate(db, 1, near) == ("near", "1-a")
+
+
+def test_update_policy_only_matches_recent_same_title(monkeypatch):
+    monkeypatch.setattr(dedupe_service, "NEAR_DUPLICATE_POLICY", "update")
+    db = make_session()
+    stored = Fingerprint(content_hash="h1", simhash=12345, title_hash="meeting")
+    record_fingerprint(db, 1, "1-a", stored)
+
+    autosave = Fingerprint(content_hash="h2", simhash=12345 ^ 1, title_hash="meeting")
+    renamed = Fingerprint(content_hash="h3", simhash=12345 ^ 1, title_hash="meeting next week")
+    assert find_duplicate(db, 1, autosave) == ("near", "1-a")
+    assert find_duplicate(db, 1, renamed) == (None, None)
+
+    # Last week's note with the same title is not an autosave - never overwritten
+    monkeypatch.setattr(dedupe_service, "NEAR_DUPLICATE_WINDOW_S", -3600)
+    assert find_duplicate(db, 1, autosave) == (None, None)
+
+
+def test_off_policy_only_catches_exact(monkeypatch):
+    monkeypatch.setattr(dedupe_service, "NEAR_DUPLICATE_POLICY", "off")
+    db = make_session()
+    stored = Fingerprint(content_hash="h1", simhash=12345, title_hash="t")
+    record_fingerprint(db, 1, "1-a", stored)
+
+    near = Fingerprint(content_hash="h2", simhash=12345 ^ 1, title_hash="t")
+    assert find_duplicate(db, 1, near) == (None, None)
+    assert find_duplicate(db, 1, stored) == ("exact", "1-a")
+
+
+# ============ Idempotency-Key ============
+
+def make_session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'dedupe.db'}")
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+
+def test_concurrent_retries_save_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedupe_service, "IDEMPOTENCY_POLL_S", 0.01)
+    Session = make_session_factory(tmp_path)
+    saves = []
+    results = []
+    barrier = threading.Barrier(4)
+
+    def request(attempt):
+        db = Session()
+        barrier.wait()
+        reservation = reserve_idempotency_key(db, 1, "retry-1", f"1-note{attempt}")
+        if not reservation.completed:
+            saves.append(reservation.note_id)
+            time.sleep(0.1)  # embed + store
+            complete_idempotency_key(db, 1, "retry-1", reservation.note_id)
+        results.append(reservation.note_id)
+        db.close()
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(saves) == 1
+    assert results == saves * 4
+
+
+def test_retry_after_failed_save_reuses_the_note_id(tmp_path):
+    db = make_session_factory(tmp_path)()
+    first = reserve_idempotency_key(db, 1, "k", "1-first")
+    assert first == Reservation(note_id="1-first", completed=False)
+
+    # The save timed out - its upsert may still land under 1-first
+    release_idempotency_key(db, 1, "k")
+    retry = reserve_idempotency_key(db, 1, "k", "1-second")
+    assert retry == Reservation(note_id="1-first", completed=False)
+
+    complete_idempotency_key(db, 1, "k", retry.note_id)
+    assert reserve_idempotency_key(db, 1, "k", "1-third") == Reservation(note_id="1-first", completed=True)
+    # Keys are per user; no key = no reservation
+    assert reserve_idempotency_key(db, 2, "k", "2-a") == Reservation(note_id="2-a", completed=False)
+    assert reserve_idempotency_key(db, 1, None, "1-b") == Reservation(note_id="1-b", completed=False)
+
+
+def test_pending_key_times_out_with_conflict(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedupe_service, "IDEMPOTENCY_POLL_S", 0.01)
+    monkeypatch.setattr(dedupe_service, "remaining", lambda: 0.05)
+    Session = make_session_factory(tmp_path)
+    assert not reserve_idempotency_key(Session(), 1, "k", "1-a").completed
+    with pytest.raises(IdempotencyConflict):
+        reserve_idempotency_key(Session(), 1, "k", "1-b")
+
+
+def test_abandoned_reservation_is_taken_over(tmp_path, monkeypatch):
+    Session = make_session_factory(tmp_path)
+    assert not reserve_idempotency_key(Session(), 1, "k", "1-a").completed
+    # The first request's worker died before completing the key
+    monkeypatch.setattr(dedupe_service, "IDEMPOTENCY_PENDING_TIMEOUT_S", -3600)
+    assert reserve_idempotency_key(Session(), 1, "k", "1-b") == Reservation(note_id="1-a", completed=False)
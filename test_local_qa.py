@@ -0,0 +1,121 @@
+# test_local_qa.py
+import pytest
+import torch
+from tokenizers import Tokenizer, models, pre_tokenizers, processors
+import local_qa_service
+from local_qa_service import _best_span, _best_answer
+
+CONTEXT_WORDS = [f"w{i}" for i in range(40)]
+CONTEXT_WORDS[29] = "needle"
+
+
+def make_tokenizer(max_length: int = 16, stride: int = 4) -> Tokenizer:
+    """Word-level stand-in for the RoBERTa tokenizer: same pair template and windowing."""
+    vocab = {token: i for i, token in enumerate(["<pad>", "<s>", "</s>", "<unk>", "where", "is", "it", *CONTEXT_WORDS])}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer.post_processor = processors.TemplateProcessing(
+        single="<s> $A </s>",
+        pair="<s> $A </s> </s> $B </s>",
+        special_tokens=[("<s>", 1), ("</s>", 2)]
+    )
+    tokenizer.enable_truncation(max_length=max_length, stride=stride, strategy="only_second")
+    return tokenizer
+
+
+def peaked_logits(length: int, start: int, end: int):
+    start_logits = torch.zeros(length)
+    end_logits = torch.zeros(length)
+    start_logits[start] = 10.0
+    end_logits[end] = 10.0
+    return start_logits, end_logits
+
+
+# ============ _best_span ============
+
+def test_best_span_picks_highest_valid_pair():
+    start_logits = torch.tensor([0.0, 5.0, 1.0, 0.0])
+    end_logits = torch.tensor([0.0, 0.0, 1.0, 4.0])
+    mask = torch.tensor([True, True, True, True])
+    assert _best_span(start_logits, end_logits, mask) == (1, 3, 9.0)
+
+
+def test_best_span_never_ends_before_it_starts():
+    # The best start comes after the best end - that pair is invalid
+    start_logits = torch.tensor([0.0, 0.0, 0.0, 9.0])
+    end_logits = torch.tensor([9.0, 0.0, 0.0, 1.0])
+    mask = torch.ones(4, dtype=torch.bool)
+    start, end, _ = _best_span(start_logits, end_logits, mask)
+    assert start <= end
+
+
+def test_best_span_respects_max_answer_tokens(monkeypatch):
+    monkeypatch.setattr(local_qa_service, "QA_MAX_ANSWER_TOKENS", 3)
+    start_logits, end_logits = peaked_logits(10, 1, 8)
+    start, end, _ = _best_span(start_logits, end_logits, torch.ones(10, dtype=torch.bool))
+    assert end - start < 3
+
+
+def test_best_span_stays_inside_the_context():
+    # Question tokens (and special tokens) score highest but are masked out
+    start_logits, end_logits = peaked_logits(8, 1, 2)
+    start_logits[5], end_logits[6] = 1.0, 1.0
+    mask = torch.tensor([False, False, False, False, True, True, True, False])
+    start, end, score = _best_span(start_logits, end_logits, mask)
+    assert (start, end) == (5, 6)
+    assert score == 2.0
+
+
+def test_best_span_without_context_scores_minus_infinity():
+    start_logits, end_logits = peaked_logits(4, 0, 1)
+    _, _, score = _best_span(start_logits, end_logits, torch.zeros(4, dtype=torch.bool))
+    assert score == float("-inf")
+
+
+# ============ windows -> character offsets ============
+
+@pytest.fixture
+def windows():
+    context = " ".join(CONTEXT_WORDS)
+    encoding = make_tokenizer().encode("where is it", context)
+    return context, [encoding] + encoding.overflowing
+
+
+def test_window_offsets_point_into_the_original_context(windows):
+    context, encodings = windows
+    assert len(encodings) > 2
+    for window in encodings:
+        for token, sequence_id, (char_start, char_end) in zip(window.tokens, window.sequence_ids, window.offsets):
+            if sequence_id == 1:
+                assert context[char_start:char_end] == token
+
+
+def test_best_answer_maps_a_later_window_back_to_characters(windows):
+    context, encodings = windows
+    start_logits, end_logits = [], []
+    for window in encodings:
+        # Padding after the window's tokens, as in a batched forward pass
+        length = len(window.ids) + 3
+        if "needle" in window.tokens and window.sequence_ids[window.tokens.index("needle")] == 1:
+            position = window.tokens.index("needle")
+            window_start, window_end = peaked_logits(length, position, position)
+        else:
+            window_start, window_end = torch.zeros(length), torch.zeros(length)
+        start_logits.append(window_start)
+        end_logits.append(window_end)
+
+    best = _best_answer(context, encodings, start_logits, end_logits)
+    assert best["answer"] == "needle"
+    assert (best["start"], best["end"]) == (context.index("needle"), context.index("needle") + len("needle"))
+    assert best["score"] == 20.0
+
+
+def test_best_answer_spans_multiple_tokens(windows):
+    context, encodings = windows
+    first = encodings[0]
+    context_positions = [i for i, sid in enumerate(first.sequence_ids) if sid == 1]
+    start, end = context_positions[1], context_positions[3]
+    start_logits, end_logits = peaked_logits(len(first.ids), start, end)
+
+    best = _best_answer(context, [first], [start_logits], [end_logits])
+    assert best["answer"] == "w1 w2 w3"
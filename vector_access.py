@@ -0,0 +1,202 @@
+import os
+import json
+import threading
+from collections import deque
+from typing import Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
+PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME")
+PINECONE_HOST = os.getenv("PINECONE_HOST")
+
+# "grpc" = long-lived HTTP/2 channel with protobuf payloads, "rest" = JSON over HTTPS
+VECTOR_TRANSPORT = os.getenv("VECTOR_TRANSPORT", "grpc")
+
+# Pinecone rejects upsert requests above 2 MB or 1000 vectors; stay below both
+UPSERT_MAX_VECTORS = int(os.getenv("UPSERT_MAX_VECTORS", "200"))
+UPSERT_MAX_BYTES = int(os.getenv("UPSERT_MAX_BYTES", str(1_800_000)))
+# Upsert / fetch requests allowed in flight at once
+MAX_IN_FLIGHT = int(os.getenv("VECTOR_MAX_IN_FLIGHT", "8"))
+FETCH_BATCH_SIZE = 100
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(index_name: Optional[str] = None, transport: Optional[str] = None):
+    """
+    Shared, long-lived index client for (transport, index name).
+
+    Clients are created lazily on first use, so each process (and each
+    server.py worker after the fork) opens its own channel exactly once.
+    """
+    name = index_name or PINECONE_INDEX_NAME
+    transport = transport or VECTOR_TRANSPORT
+    key = (transport, name)
+
+    with _indexes_lock:
+        if key not in _indexes:
+            host = PINECONE_HOST if name == PINECONE_INDEX_NAME and PINECONE_HOST else ""
+            if transport == "grpc":
+                from pinecone.grpc import PineconeGRPC
+                _indexes[key] = PineconeGRPC(api_key=PINECONE_API_KEY).Index(name=name, host=host)
+            elif transport == "rest":
+                from pinecone import Pinecone
+                _indexes[key] = Pinecone(api_key=PINECONE_API_KEY).Index(name=name, host=host, pool_threads=MAX_IN_FLIGHT)
+            else:
+                raise ValueError(f"Unknown VECTOR_TRANSPORT '{transport}' (expected 'grpc' or 'rest')")
+            print(f"🔌 Pinecone {transport} client ready for index '{name}'")
+        return _indexes[key]
+
+
+def _timeout_kwargs(transport: str, timeout: Optional[float]) -> dict:
+    """Per-call timeout, in each transport's own keyword."""
+    if timeout is None:
+        return {}
+    return {"timeout": timeout} if transport == "grpc" else {"_request_timeout": timeout}
+
+
+def _wait(future):
+    """Result of an async request (gRPC futures and REST ApplyResults differ)."""
+    return future.result() if hasattr(future, "result") else future.get()
+
+
+def _estimated_bytes(vector: dict, transport: str) -> int:
+    # float32 on the wire for gRPC, ~20 characters per float in REST JSON
+    per_value = 4 if transport == "grpc" else 20
+    return len(vector["id"]) + len(json.dumps(vector.get("metadata") or {})) + per_value * len(vector["values"])
+
+
+def _upsert_batches(vectors: list, transport: str):
+    """Split vectors into requests bounded by both count and payload size."""
+    batch, batch_bytes = [], 0
+    for vector in vectors:
+        size = _estimated_bytes(vector, transport)
+        if batch and (len(batch) >= UPSERT_MAX_VECTORS or batch_bytes + size > UPSERT_MAX_BYTES):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(vector)
+        batch_bytes += size
+    if batch:
+        yield batch
+
+
+# ============ DATA PLANE ============
+
+def upsert(vectors: list, index_name: Optional[str] = None, transport: Optional[str] = None) -> int:
+    """
+    Write vectors ({"id", "values", "metadata"} dicts), splitting large
+    writes into size-bounded batches that are sent in parallel.
+
+    Returns:
+        int: Number of vectors upserted
+    """
+    transport = transport or VECTOR_TRANSPORT
+    index = get_index(index_name, transport)
+
+    upserted = 0
+    in_flight = deque()
+    for batch in _upsert_batches(vectors, transport):
+        if len(in_flight) >= MAX_IN_FLIGHT:
+            upserted += _wait(in_flight.popleft()).upserted_count
+        in_flight.append(index.upsert(vectors=batch, async_req=True))
+
+    while in_flight:
+        upserted += _wait(in_flight.popleft()).upserted_count
+    return upserted
+
+
+def query(vector: list, top_k: int, filter: Optional[dict] = None, include_metadata: bool = True, include_values: bool = False,
+          index_name: Optional[str] = None, transport: Optional[str] = None, timeout: Optional[float] = None) -> list:
+    """
+    Nearest neighbours of `vector`.
+
+    Returns:
+        list: [{"id", "score", "metadata", "values"}] best match first
+    """
+    transport = transport or VECTOR_TRANSPORT
+    response = get_index(index_name, transport).query(
+        vector=vector,
+        top_k=top_k,
+        filter=filter,
+        include_metadata=include_metadata,
+        include_values=include_values,
+        **_timeout_kwargs(transport, timeout)
+    )
+    return [
+        {
+            "id": match.id,
+            "score": match.score,
+            "metadata": dict(match.metadata or {}),
+            "values": list(match.values or []) if include_values else []
+        }
+        for match in response.matches
+    ]
+
+
+def fetch(ids: list, index_name: Optional[str] = None, transport: Optional[str] = None) -> dict:
+    """
+    Vectors by id, fetched in parallel batches.
+
+    Returns:
+        dict: id -> {"id", "values", "metadata"} (missing ids are left out)
+    """
+    transport = transport or VECTOR_TRANSPORT
+    index = get_index(index_name, transport)
+
+    if transport == "grpc":
+        futures = [
+            index.fetch(ids=ids[i:i + FETCH_BATCH_SIZE], async_req=True)
+            for i in range(0, len(ids), FETCH_BATCH_SIZE)
+        ]
+        responses = [_wait(f) for f in futures]
+    else:
+        # The REST fetch has no async_req; batches are small enough to go in sequence
+        responses = [index.fetch(ids=ids[i:i + FETCH_BATCH_SIZE]) for i in range(0, len(ids), FETCH_BATCH_SIZE)]
+
+    vectors = {}
+    for response in responses:
+        for vector_id, vector in response.vectors.items():
+            vectors[vector_id] = {
+                "id": vector_id,
+                "values": list(vector.values or []),
+                "metadata": dict(vector.metadata or {})
+            }
+    return vectors
+
+
+def delete(ids: list, index_name: Optional[str] = None, transport: Optional[str] = None):
+    """Delete vectors by id (unknown ids are ignored)."""
+    index = get_index(index_name, transport)
+    for i in range(0, len(ids), 1000):
+        index.delete(ids=ids[i:i + 1000])
+
+
+def update_metadata(vector_id: str, metadata: dict, index_name: Optional[str] = None, transport: Optional[str] = None):
+    """Set metadata fields on one vector without re-sending its values."""
+    get_index(index_name, transport).update(id=vector_id, set_metadata=metadata)
+
+
+def list_ids(prefix: Optional[str] = None, cursor: Optional[str] = None, limit: int = 100,
+             index_name: Optional[str] = None, transport: Optional[str] = None) -> tuple:
+    """
+    One page of vector ids starting with `prefix`.
+
+    Returns:
+        tuple: (ids, next_cursor) - next_cursor is None on the last page
+    """
+    list_kwargs = {"limit": limit}
+    if prefix:
+        list_kwargs["prefix"] = prefix
+    if cursor:
+        list_kwargs["pagination_token"] = cursor
+
+    listed = get_index(index_name, transport).list_paginated(**list_kwargs)
+    next_cursor = listed.pagination.next if listed.pagination else None
+    return [v.id for v in listed.vectors], next_cursor
+
+
+def describe_index_stats(index_name: Optional[str] = None, transport: Optional[str] = None):
+    return get_index(index_name, transport).describe_index_stats()
@@ -0,0 +1,215 @@
+import os
+import json
+import asyncio
+from collections import OrderedDict
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
+from database import SessionLocal
+from models import User
+from jwt_utils import verify_access_token
+from langchain_pinecone_service import embed_search_query, search_notes_by_vector, build_note_filter
+from deadlines import DeadlineExceeded, deadline_for, set_deadline
+
+# Per-connection limits and caches
+WS_MAX_IN_FLIGHT = int(os.getenv("WS_MAX_IN_FLIGHT", "4"))        # queries running at once
+WS_EMBEDDING_CACHE_SIZE = int(os.getenv("WS_EMBEDDING_CACHE_SIZE", "128"))
+WS_AUTH_TIMEOUT_S = float(os.getenv("WS_AUTH_TIMEOUT_S", "5"))     # wait for the auth frame this long
+
+router = APIRouter(tags=["Chat"])
+
+
+class ChatConnection:
+    """
+    State of one authenticated /ws/chat connection: the user (looked up
+    once at connect), recent query embeddings and the queries currently
+    running (by correlation id).
+
+    Only embeddings are cached: results are searched every time, so a note
+    saved a moment ago shows up in the very next answer.
+    """
+
+    def __init__(self, websocket: WebSocket, token: str, user: User):
+        self.websocket = websocket
+        self.token = token
+        self.user_id = user.id
+        self.email = user.email
+        self.embeddings = OrderedDict()   # query -> (vector, index_name)
+        self.tasks = {}                   # correlation id -> asyncio.Task
+        self.in_flight = asyncio.Semaphore(WS_MAX_IN_FLIGHT)
+        self.send_lock = asyncio.Lock()
+
+    async def send(self, payload: dict):
+        async with self.send_lock:
+            await self.websocket.send_json(payload)
+
+    def _cached_embedding(self, query: str):
+        if query in self.embeddings:
+            self.embeddings.move_to_end(query)
+            return self.embeddings[query]
+        return None
+
+    def _remember_embedding(self, query: str, embedded: tuple):
+        self.embeddings[query] = embedded
+        while len(self.embeddings) > WS_EMBEDDING_CACHE_SIZE:
+            self.embeddings.popitem(last=False)
+
+    def _note_filter(self, message: dict) -> dict:
+        """The message's Pinecone filter (ValueError for malformed filter fields)."""
+        tags = message.get("tags")
+        if tags is not None and not isinstance(tags, list):
+            raise ValueError("'tags' must be a list")
+        try:
+            return build_note_filter(self.user_id, message.get("created_after"), message.get("created_before"), tags)
+        except (TypeError, ValueError):
+            raise ValueError("'created_after' and 'created_before' must be epoch seconds")
+
+    async def run_query(self, message_id: str, message: dict):
+        """Search for one chat message and send back its result (or error)."""
+        query = str(message["message"]).strip()
+
+        try:
+            try:
+                filter_dict = self._note_filter(message)
+            except ValueError as e:
+                await self.send({"id": message_id, "type": "error", "detail": str(e)})
+                return
+
+            async with self.in_flight:
+                # Each message gets its own time budget (context is per task)
+                set_deadline(deadline_for("/api/chat", message.get("timeout_ms")))
+
+                # Step 1 - Embed (skipped when the same text was asked before)
+                embedded = self._cached_embedding(query)
+                if embedded is None:
+                    embedded = await asyncio.to_thread(embed_search_query, query)
+                    self._remember_embedding(query, embedded)
+                query_vector, index_name = embedded
+
+                # Step 2 - Search; a query superseded meanwhile never gets here
+                result = await asyncio.to_thread(
+                    search_notes_by_vector, query_vector, self.user_id, 3, filter_dict, index_name
+                )
+
+            await self.send({"id": message_id, "type": "result", "reply": result["answer"], "count": result["count"]})
+        except asyncio.CancelledError:
+            try:
+                await self.send({"id": message_id, "type": "cancelled"})
+            except Exception:
+                pass  # connection already closed
+        except DeadlineExceeded as e:
+            await self.send({"id": message_id, "type": "error", "detail": str(e)})
+        except Exception as e:
+            print(f"❌ WebSocket query {message_id} for user {self.user_id} failed: {e}")
+            await self.send({"id": message_id, "type": "error", "detail": "Search failed"})
+        finally:
+            self.tasks.pop(message_id, None)
+
+    def cancel(self, message_id: str = None):
+        """Cancel one running query, or all of them (message_id None)."""
+        ids = [message_id] if message_id is not None else list(self.tasks)
+        for task_id in ids:
+            task = self.tasks.get(task_id)
+            if task is not None:
+                task.cancel()
+
+
+def _authenticate(token: str):
+    """Resolve the connection's user once (None if the token is invalid)."""
+    email = verify_access_token(token) if token else None
+    if email is None:
+        return None
+    db = SessionLocal()
+    try:
+        return db.query(User).filter(User.email == email).first()
+    finally:
+        db.close()
+
+
+async def _receive_auth_token(websocket: WebSocket):
+    """The token from the client's first frame, {"type": "auth", "token": ...} (None if it isn't one)."""
+    try:
+        message = json.loads(await asyncio.wait_for(websocket.receive_text(), WS_AUTH_TIMEOUT_S))
+    except (asyncio.TimeoutError, json.JSONDecodeError):
+        return None
+    if not isinstance(message, dict) or message.get("type") != "auth" or not isinstance(message.get("token"), str):
+        return None
+    return message["token"]
+
+
+@router.websocket("/ws/chat")
+async def chat_socket(websocket: WebSocket):
+    """
+    Interactive chat over one WebSocket (authenticated once per connection).
+
+    Authenticate with an "Authorization: Bearer <jwt>" header, or - from a
+    browser, which can't set headers - with an auth frame as the first
+    message. Tokens in the URL are not accepted: access and proxy logs
+    record query strings.
+
+    Client -> server:
+        {"type": "auth", "token": "<jwt>"}     (first message, unless the header was sent)
+        {"id": "q1", "message": "meeting notes", "tags": ["work"]}
+            (optional: created_after / created_before as epoch seconds,
+             timeout_ms, "supersede": true to cancel every running query first)
+        {"type": "cancel", "id": "q1"}
+
+    Server -> client (matched by "id"; pipelined queries may finish out of order):
+        {"id": "q1", "type": "result", "reply": "...", "count": 2}
+        {"id": "q1", "type": "cancelled"}
+        {"id": "q1", "type": "error", "detail": "..."}
+    """
+    authorization = websocket.headers.get("authorization", "")
+    token = authorization[7:] if authorization.lower().startswith("bearer ") else None
+
+    await websocket.accept()
+    if token is None:
+        try:
+            token = await _receive_auth_token(websocket)
+        except WebSocketDisconnect:
+            return
+
+    user = await asyncio.to_thread(_authenticate, token)
+    if user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Could not validate credentials")
+        return
+
+    connection = ChatConnection(websocket, token, user)
+    print(f"User {user.email} (ID: {user.id}) opened a chat socket")
+
+    try:
+        while True:
+            # A malformed message gets an error reply - it doesn't end the session
+            try:
+                message = json.loads(await websocket.receive_text())
+            except json.JSONDecodeError:
+                await connection.send({"id": "", "type": "error", "detail": "Invalid JSON"})
+                continue
+            if not isinstance(message, dict):
+                await connection.send({"id": "", "type": "error", "detail": "Messages must be JSON objects"})
+                continue
+
+            # The token can expire during a long session; checking it needs no DB lookup
+            if verify_access_token(connection.token) is None:
+                await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Token expired")
+                break
+
+            message_id = str(message.get("id", ""))
+            if message.get("type") == "cancel":
+                connection.cancel(message_id or None)
+                continue
+
+            if not message_id or not str(message.get("message", "")).strip():
+                await connection.send({"id": message_id, "type": "error", "detail": "'id' and 'message' are required"})
+                continue
+            if message_id in connection.tasks:
+                await connection.send({"id": message_id, "type": "error", "detail": "Duplicate id"})
+                continue
+
+            # User kept typing: drop the queries this one replaces
+            if message.get("supersede"):
+                connection.cancel()
+
+            connection.tasks[message_id] = asyncio.create_task(connection.run_query(message_id, message))
+    except WebSocketDisconnect:
+        print(f"User {connection.email} closed the chat socket")
+    finally:
+        connection.cancel()